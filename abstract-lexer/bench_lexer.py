@@ -0,0 +1,289 @@
+# benchmarks the compiled lexer (with and without run scanning) and the generated
+# lexer against the interpreted one, with and without its table validated,
+# checking they all produce the same tokens
+# run from the abstract-lexer directory: python bench_lexer.py
+
+from argparse import ArgumentParser
+from importlib.util import spec_from_file_location, module_from_spec
+from io import StringIO
+from random import Random
+from time import perf_counter
+import sys
+import tracemalloc
+
+sys.path.insert(1,"../infix-plus")
+
+from lexer import AbstractLexer
+from codegen import GeneratedLexer
+import ipl
+from ipp import InfixPlusParser, PackratParser, PushdownParser
+
+def load_infix_spec():
+    # infix-spec.py isn't a valid module name, so load it by path
+    spec = spec_from_file_location("infix_spec", "infix-spec.py")
+    module = module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+def make_number(rng : Random) -> str:
+    number = str(rng.randint(0, 10000))
+    if rng.random() < 0.3:
+        number += "." + str(rng.randint(0, 999))
+    return number
+
+def make_ipl_term(rng : Random, depth : int = 0) -> str:
+    roll = rng.random()
+    if roll < 0.4:
+        term = make_number(rng)
+    elif roll < 0.8 or depth > 2:
+        term = "".join(rng.choice("abcdefghijklmnopqrstuvwxyz_") for _ in range(rng.randint(1, 12)))
+    else:
+        term = "(" + make_ipl_expr(rng, depth + 1) + ")"
+    if rng.random() < 0.2:
+        term = "-" * rng.randint(1, 3) + term
+    return term
+
+def make_ipl_expr(rng : Random, depth : int = 0) -> str:
+    terms = [make_ipl_term(rng, depth) for _ in range(rng.randint(1, 6))]
+    out = terms[0]
+    for term in terms[1:]:
+        out += rng.choice([" + ", " - ", " * ", " / ", "+", "*"]) + term
+    return out
+
+def make_ipl_source(size : int, seed : int = 0) -> str:
+    rng = Random(seed)
+    lines = []
+    length = 0
+    while length < size:
+        line = make_ipl_expr(rng)
+        if rng.random() < 0.5:
+            line = "".join(rng.choice("abcdefghijklmnopqrstuvwxyz") for _ in range(rng.randint(1, 8))) + " = " + line
+        if rng.random() < 0.3:
+            line += " # " + "".join(rng.choice("abcdefghijklmnopqrstuvwxyz ") for _ in range(rng.randint(5, 40)))
+        lines.append(line)
+        length += len(line) + 1
+    return "\n".join(lines)
+
+def make_long_run_source(size : int, seed : int = 0) -> str:
+    # long identifiers, numbers and comments: the best case for run scanning
+    rng = Random(seed)
+    lines = []
+    length = 0
+    while length < size:
+        name = "".join(rng.choice("abcdefghijklmnopqrstuvwxyz_") for _ in range(rng.randint(20, 60)))
+        number = "".join(rng.choice("0123456789") for _ in range(rng.randint(10, 30)))
+        comment = "".join(rng.choice("abcdefghijklmnopqrstuvwxyz ") for _ in range(rng.randint(40, 200)))
+        line = f"{name} = {number} * {name} # {comment}"
+        lines.append(line)
+        length += len(line) + 1
+    return "\n".join(lines)
+
+def make_spec_source(size : int, seed : int = 0) -> str:
+    # the infix-spec table has no EOF after brackets, so always end on a number
+    rng = Random(seed)
+    parts = []
+    length = 0
+    while length < size:
+        # the minus state only accepts numbers, so brackets never follow a minus
+        part = rng.choice(["", "", "- ", "- -"]) + make_number(rng) + rng.choice([" + ", " / ", " * "])
+        if rng.random() < 0.2:
+            part = "(" + make_number(rng) + " * " + make_number(rng) + ") " + rng.choice(["+ ", "/ "])
+        parts.append(part)
+        length += len(part)
+    parts.append("1")
+    return "".join(parts)
+
+def time_lex(lexer : AbstractLexer, source : str, repeats : int):
+    best = None
+    tokens = None
+    for _ in range(repeats):
+        start = perf_counter()
+        tokens = lexer.lex(source)
+        elapsed = perf_counter() - start
+        if best == None or elapsed < best:
+            best = elapsed
+    return best, list(tokens)
+
+def compare(name : str, transitions, start_state : str, source : str, repeats : int):
+    # unchecked is the interpreted lexer looking for overlaps on every character
+    unchecked = AbstractLexer(transitions, start_state, compiled=False, validate=False)
+    interpreted = AbstractLexer(transitions, start_state, compiled=False)
+    compiled = AbstractLexer(transitions, start_state, scan_runs=False)
+    runs = AbstractLexer(transitions, start_state)
+    generated = GeneratedLexer(transitions, start_state)
+
+    unchecked_time, unchecked_tokens = time_lex(unchecked, source, repeats)
+    old_time, old_tokens = time_lex(interpreted, source, repeats)
+    new_time, new_tokens = time_lex(compiled, source, repeats)
+    runs_time, runs_tokens = time_lex(runs, source, repeats)
+    generated_time, generated_tokens = time_lex(generated, source, repeats)
+
+    if old_tokens != unchecked_tokens:
+        raise AssertionError(f"{name}: stopping at the first match produced a different token stream")
+    if old_tokens != new_tokens:
+        raise AssertionError(f"{name}: compiled lexer produced a different token stream")
+    if old_tokens != runs_tokens:
+        raise AssertionError(f"{name}: run scanning produced a different token stream")
+    if old_tokens != generated_tokens:
+        raise AssertionError(f"{name}: generated lexer produced a different token stream")
+
+    print(f"{name:<12}{len(source):>10}{len(new_tokens):>10}{unchecked_time:>14.4f}{old_time:>14.4f}{new_time:>14.4f}{runs_time:>14.4f}{generated_time:>14.4f}")
+
+def check_merging(size : int):
+    # neither table has equivalent states, so give infix-plus a copy of its
+    # token state and check merging finds it and lexes the same
+    transitions = {state : list(state_transitions) for state, state_transitions in ipl.transitions.items()}
+    transitions['token-copy'] = list(transitions['token'])
+    transitions['start'] = [expr if expr[1] != 'token' else (expr[0], 'token-copy', expr[2]) for expr in transitions['start']]
+    merged = AbstractLexer(transitions, "start", merge_states=True)
+    if merged.merged != {'token-copy': 'token'}:
+        raise AssertionError(f"expected token-copy to merge into token, merged {merged.merged}")
+    source = make_ipl_source(size)
+    if merged.lex(source) != ipl.InfixPlusLexer().lex(source):
+        raise AssertionError("merging states produced a different token stream")
+    for table, start_state in ((ipl.transitions, "start"), (load_infix_spec().transitions, "neutral")):
+        if AbstractLexer(table, start_state, merge_states=True).merged != {}:
+            raise AssertionError(f"found equivalent states in the {start_state} table")
+    print(f"Merged {merged.merged} and lexed {size} characters the same")
+
+def compare_incremental(size : int, edits : int, seed : int = 0):
+    # random line edits on a large source: the incremental lexer has to give
+    # the same tokens as lexing the edited text from scratch
+    rng = Random(seed)
+    source = make_ipl_source(size)
+    full = ipl.InfixPlusLexer()
+    incremental = ipl.IncrementalInfixPlusLexer(source)
+
+    start = perf_counter()
+    full.lex(source)
+    full_time = perf_counter() - start
+
+    edit_time = 0.0
+    lexed = 0
+    for i in range(edits):
+        first = rng.randint(0, len(incremental.lines) - 1)
+        last = first + rng.choice([0, 1, 1, 2])
+        text = "".join(make_ipl_expr(rng) + "\n" for _ in range(rng.randint(0, 2)))
+        start = perf_counter()
+        lexed += incremental.replace_lines(first, min(last, len(incremental.lines) - 1), text)
+        edit_time += perf_counter() - start
+        # checking every edit would cost a full lex each, so only check some
+        if i % 50 == 0 and incremental.tokens() != full.lex(incremental.text()):
+            raise AssertionError(f"incremental tokens differ after edit {i}")
+
+    if incremental.tokens() != full.lex(incremental.text()):
+        raise AssertionError("incremental tokens differ after the last edit")
+    print(f"{len(incremental.lines)} lines, full lex {full_time:.4f}s, {edits} edits averaging {edit_time / edits * 1000:.3f}ms and {lexed / edits:.1f} lines lexed each")
+
+def compare_parsers(size : int, repeats : int):
+    # the packrat parser against the recursive descent one, on the same tokens
+    source = make_ipl_source(size)
+    lexer = ipl.InfixPlusLexer()
+    tokens = lexer.lex(source)
+    compact = lexer.lex_compact(source, ipl.IPLexToken)
+    results = []
+    for name, parser, parse_tokens in (
+        ("descent", InfixPlusParser(), tokens),
+        ("packrat", PackratParser(), tokens),
+        ("bounded", PackratParser(64), tokens),
+        ("no memo", PackratParser(0), tokens),
+        ("compact", PackratParser(), compact),
+        ("pushdown", PushdownParser(), tokens),
+    ):
+        best = None
+        for _ in range(repeats):
+            start = perf_counter()
+            nodes = list(parser.parse_lines(parse_tokens) if isinstance(parser, PackratParser) else parser.parse_stream(parse_tokens))
+            elapsed = perf_counter() - start
+            if best == None or elapsed < best:
+                best = elapsed
+        results.append(nodes)
+        if nodes != results[0]:
+            raise AssertionError(f"{name} parser gave a different tree at {size} characters")
+        print(f"{size:>10}{len(tokens):>10}  {name:<10}{best:>10.4f}")
+
+    # lexing and parsing together: the descent parser after a full lex, and
+    # the pushdown parser pulling tokens from lex_iter as it goes
+    for name, run in (
+        ("lex+descent", lambda : list(InfixPlusParser().parse_stream(lexer.lex(source)))),
+        ("lex_iter+pushdown", lambda : list(PushdownParser().parse_iter(lexer.lex_iter(StringIO(source), 4096)))),
+    ):
+        elapsed, _, peak, nodes = measure(run)
+        if nodes != results[0]:
+            raise AssertionError(f"{name} gave a different tree at {size} characters")
+        print(f"{size:>10}{len(tokens):>10}  {name:<18}{elapsed:>10.4f}{peak / 1e6:>10.1f}MB peak")
+
+def measure(fn):
+    # returns (seconds, bytes still allocated by the result, peak bytes)
+    start = perf_counter()
+    fn()
+    elapsed = perf_counter() - start
+
+    tracemalloc.start()
+    result = fn()
+    retained, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed, retained, peak, result
+
+def compare_compact(token_count : int):
+    # ~3.9 characters per token in the generated infix-plus source
+    source = make_ipl_source(int(token_count * 3.9))
+    lexer = ipl.InfixPlusLexer()
+    parser = InfixPlusParser()
+
+    list_time, list_bytes, list_peak, tokens = measure(lambda : lexer.lex(source))
+    compact_time, compact_bytes, compact_peak, compact = measure(lambda : lexer.lex_compact(source, ipl.IPLexToken))
+
+    if list(compact) != tokens:
+        raise AssertionError("compact tokens differ from the token list")
+
+    start = perf_counter()
+    list_nodes = list(parser.parse_stream(tokens))
+    list_parse = perf_counter() - start
+    start = perf_counter()
+    compact_nodes = list(parser.parse_compact(compact))
+    compact_parse = perf_counter() - start
+
+    if list_nodes != compact_nodes:
+        raise AssertionError("parsing compact tokens gave a different tree")
+
+    print(f"{len(tokens)} tokens from {len(source)} characters, {len(compact.extras)} not sliced from the source")
+    print(f"{'form':<10}{'lex s':>10}{'parse s':>10}{'retained MB':>14}{'peak MB':>10}{'bytes/token':>13}")
+    for name, lex_time, parse_time, retained, peak in (
+        ("list", list_time, list_parse, list_bytes, list_peak),
+        ("compact", compact_time, compact_parse, compact_bytes, compact_peak),
+    ):
+        print(f"{name:<10}{lex_time:>10.3f}{parse_time:>10.3f}{retained / 1e6:>14.1f}{peak / 1e6:>10.1f}{retained / len(tokens):>13.1f}")
+
+if __name__ == "__main__":
+    arg_parser = ArgumentParser(prog="Abstract Lexer Benchmark")
+    arg_parser.add_argument('-s', '--sizes', nargs='+', type=int, default=[10000, 100000, 1000000])
+    arg_parser.add_argument('-r', '--repeats', type=int, default=3)
+    arg_parser.add_argument('-c', '--compact-tokens', type=int, help="compare token lists with TokenArray at this many tokens instead")
+    arg_parser.add_argument('-e', '--edits', type=int, help="time this many incremental edits on a source of each size instead")
+    arg_parser.add_argument('-p', '--parsers', action='store_true', help="compare the infix-plus parsers instead")
+
+    args = arg_parser.parse_args(sys.argv[1:])
+
+    if args.compact_tokens:
+        compare_compact(args.compact_tokens)
+        sys.exit(0)
+
+    if args.parsers:
+        for size in args.sizes:
+            compare_parsers(size, args.repeats)
+        sys.exit(0)
+
+    if args.edits:
+        for size in args.sizes:
+            compare_incremental(size, args.edits)
+        sys.exit(0)
+
+    check_merging(args.sizes[0])
+    infix_spec = load_infix_spec()
+
+    print(f"{'table':<12}{'chars':>10}{'tokens':>10}{'unchecked':>14}{'interpreted':>14}{'compiled':>14}{'runs':>14}{'generated':>14}")
+    for size in args.sizes:
+        compare("infix-plus", ipl.transitions, "start", make_ipl_source(size), args.repeats)
+        compare("long-runs", ipl.transitions, "start", make_long_run_source(size), args.repeats)
+        compare("infix-spec", infix_spec.transitions, "neutral", make_spec_source(size), args.repeats)
@@ -0,0 +1,185 @@
+# generates a specialised python module from a transitions table, so the
+# states and the common actions are inlined instead of interpreted per character
+
+from hashlib import sha256
+from importlib.util import spec_from_file_location, module_from_spec
+from types import ModuleType
+import os
+import re
+
+from lexer import AbstractLexer, LexTransition, LexTransitionFn, PRECOMPUTED_CHARS, flatten_actions
+
+# bump whenever the generated code changes shape, so old cache entries are ignored
+GENERATOR_VERSION = 3
+CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "__lexcache__")
+
+def ordered_transitions(state_transitions) -> list[LexTransition]:
+    if isinstance(state_transitions, (list, tuple)):
+        return list(state_transitions)
+    # sets have no stable order between runs, which would change the cache key
+    return sorted(state_transitions, key=lambda expr : (expr[0] or "", expr[1]))
+
+def describe_action(fn : LexTransitionFn, actions : list[LexTransitionFn]) -> str:
+    func = getattr(fn, "__func__", None)
+    if func is AbstractLexer.accumulate.__func__:
+        return "accumulate"
+    if func is AbstractLexer.reset_token.__func__:
+        return "reset_token"
+    if fn not in actions:
+        actions.append(fn)
+    return f"A{actions.index(fn)}"
+
+def describe_table(transitions : dict[str, list[LexTransition]]) -> tuple[list, list[LexTransitionFn]]:
+    # a description of the table which only refers to actions by position,
+    # so it can be hashed and used to generate code
+    actions = []
+    description = []
+    for state, state_transitions in transitions.items():
+        described = []
+        for expr in ordered_transitions(state_transitions):
+            if expr[0] == None:
+                continue
+            described.append((expr[0], expr[1], tuple(describe_action(fn, actions) for fn in flatten_actions(expr[2]))))
+        description.append((state, described))
+    return description, actions
+
+def table_key(description : list) -> str:
+    text = repr((GENERATOR_VERSION, len(PRECOMPUTED_CHARS), description))
+    return sha256(text.encode("utf-8")).hexdigest()[:24]
+
+def char_test(chars : list[str]) -> str:
+    if len(chars) == 1:
+        return f"c == {chars[0]!r}"
+    return f"c in {frozenset_name(chars)}"
+
+def frozenset_name(chars : list[str]) -> str:
+    return "C_" + sha256("".join(chars).encode("utf-8")).hexdigest()[:12]
+
+def generate_source(description : list, key : str) -> str:
+    state_ids = {state : i for i, (state, _) in enumerate(description)}
+    constants = {}
+    body = []
+
+    for state, described in description:
+        # which ASCII characters each transition takes. overlapping characters
+        # belong to no transition, so they reach the interpreted lexer and fail there
+        patterns = [re.compile(expr[0]) for expr in described]
+        owned = [[] for _ in described]
+        for char in PRECOMPUTED_CHARS:
+            matches = [i for i, pattern in enumerate(patterns) if pattern.match(char) != None]
+            if len(matches) == 1:
+                owned[matches[0]].append(char)
+
+        keyword = "if" if len(body) == 0 else "elif"
+        body.append(f"            {keyword} state == {state_ids[state]}: # {state}")
+        first = True
+        for (pattern, next_state, action_names), chars in zip(described, owned):
+            if len(chars) == 0:
+                continue
+            if len(chars) > 1:
+                constants[frozenset_name(chars)] = "".join(chars)
+            body.append(f"                {'if' if first else 'elif'} {char_test(chars)}: # {pattern!r}")
+            first = False
+            for name in action_names:
+                if name == "accumulate":
+                    body.append("                    if token == '':")
+                    body.append("                        obj.token_start = i")
+                    body.append("                    token += c")
+                elif name == "reset_token":
+                    body.append("                    token = ''")
+                else:
+                    body.append("                    obj.token = token")
+                    body.append("                    obj.pos = i")
+                    body.append(f"                    obj.state = {next_state!r}")
+                    body.append(f"                    {name}(obj, c)")
+                    body.append("                    token = obj.token")
+            if next_state != state:
+                body.append(f"                    state = {state_ids[next_state]}")
+            body.append("                    continue")
+        # characters outside the precomputed range, or with no valid transition
+        body.append("                pass")
+
+    lines = [
+        f"# generated by codegen.py from a lexer transitions table - do not edit",
+        f"# key: {key}",
+        "",
+        f"STATES = {tuple(state for state, _ in description)!r}",
+        f"STATE_IDS = {state_ids!r}",
+        "",
+    ]
+    for name, chars in sorted(constants.items()):
+        lines.append(f"{name} = frozenset({chars!r})")
+    lines.extend(["", "def make_feed(actions):"])
+    for i in range(count_actions(description)):
+        lines.append(f"    A{i} = actions[{i}]")
+    lines.extend([
+        "",
+        "    def feed(obj, text):",
+        "        state = STATE_IDS[obj.state]",
+        "        token = obj.token",
+        "        offset = obj.offset",
+        "        obj.offset += len(text)",
+        "        for i, c in enumerate(text, offset):",
+    ])
+    lines.extend(body)
+    lines.extend([
+        "            obj.token = token",
+        "            obj.pos = i",
+        "            obj.state = STATES[state]",
+        "            obj.step_compiled(c)",
+        "            token = obj.token",
+        "            state = STATE_IDS[obj.state]",
+        "        obj.token = token",
+        "        obj.pos = obj.offset",
+        "        obj.state = STATES[state]",
+        "",
+        "    return feed",
+        "",
+    ])
+    return "\n".join(lines)
+
+def count_actions(description : list) -> int:
+    names = {
+        name
+        for _, described in description
+        for expr in described
+        for name in expr[2]
+        if name not in {"accumulate", "reset_token"}
+    }
+    return len(names)
+
+def load_module(path : str, key : str) -> ModuleType:
+    spec = spec_from_file_location(f"lexer_{key}", path)
+    module = module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+def generate_module(transitions : dict[str, list[LexTransition]], cache_dir : str = CACHE_DIR) -> tuple[ModuleType, list[LexTransitionFn]]:
+    description, actions = describe_table(transitions)
+    key = table_key(description)
+    path = os.path.join(cache_dir, f"lexer_{key}.py")
+
+    if not os.path.exists(path):
+        os.makedirs(cache_dir, exist_ok=True)
+        # write then rename so a concurrent start never imports half a file
+        temp_path = f"{path}.{os.getpid()}.tmp"
+        with open(temp_path, "w") as f:
+            f.write(generate_source(description, key))
+        os.replace(temp_path, path)
+
+    return load_module(path, key), actions
+
+class GeneratedLexer(AbstractLexer):
+    def __init__(self, transitions : dict[str, list[LexTransition]], start_state : str, cache_dir : str = CACHE_DIR):
+        super().__init__(transitions, start_state)
+        module, actions = generate_module(transitions, cache_dir)
+        self.generated_feed = module.make_feed(actions)
+
+    def compile(self, precompute : bool = False):
+        # the generated code covers the precomputed characters, so their
+        # dispatch entries and runs are never built. only the patterns and EOF
+        # actions are, and other characters resolve into dispatch as seen
+        super().compile(precompute=False)
+
+    def feed(self, input : str):
+        self.generated_feed(self, input)
@@ -79,7 +79,8 @@ transitions = {
             }
 }
 
-luthor = AbstractLexer(transitions, "neutral")
-tokens = luthor.lex("10 + 10 + (5 / 5 - 10) + 10 / -10.581")
-luthor.graphviz('./viz.gv')
-print(tokens)
\ No newline at end of file
+if __name__ == "__main__":
+    luthor = AbstractLexer(transitions, "neutral")
+    tokens = luthor.lex("10 + 10 + (5 / 5 - 10) + 10 / -10.581")
+    luthor.graphviz('./viz.gv')
+    print(tokens)
\ No newline at end of file
@@ -1,17 +1,196 @@
-from typing import Callable, Pattern, Union
+from time import perf_counter
+from typing import Callable, Iterable, Iterator, Pattern, TextIO, Union
 import re
 
+from tokenarray import TokenArray
+
+# characters whose dispatch entries are built when the lexer is constructed.
+# anything else is resolved against the patterns the first time it is seen.
+PRECOMPUTED_CHARS = [chr(i) for i in range(128)]
+
 LexTransitionFn = Callable[["AbstractLexer", str],None]
 LexTransition = tuple[Pattern,str,Union[tuple[LexTransitionFn],LexTransitionFn]]
 LexToken = tuple[int, str]
+# (next_state, actions) with the actions always flattened to a tuple
+LexDispatch = tuple[str, tuple[LexTransitionFn]]
+
+def flatten_actions(actions : Union[tuple[LexTransitionFn],LexTransitionFn]) -> tuple[LexTransitionFn]:
+    if isinstance(actions, tuple):
+        return actions
+    return (actions,)
+
+def is_accumulate(actions : tuple[LexTransitionFn]) -> bool:
+    # classmethods are rebound on every access, so compare the underlying function
+    return len(actions) == 1 and getattr(actions[0], "__func__", None) is AbstractLexer.accumulate.__func__
+
+def make_char_class(chars : list[str]) -> str:
+    return "[" + "".join(re.escape(char) for char in chars) + "]+"
+
+# the characters a table is checked against when it is built: the precomputed
+# ones, and a few others standing in for everything outside ASCII
+ANALYSED_CHARS = PRECOMPUTED_CHARS + ['\x80', '\xe9', '€', '\U0001f600']
+
+def state_dispatch(state_transitions, char : str) -> list[int]:
+    # positions of every pattern in the state matching char
+    return [i for i, expr in enumerate(state_transitions) if expr[0] != None and re.match(expr[0], char) != None]
+
+def analyse(transitions : dict[str, list[LexTransition]], start_state : str) -> dict[str, list]:
+    # errors make the table wrong on some input:
+    #   unknown - (state, next state) for transitions to states that don't exist
+    #   overlaps - (state, char, positions) where more than one pattern matches
+    #   late_eof - (state, position) for EOF transitions lex never looks at,
+    #     because only the first transition is checked for EOF
+    # the rest only mean part of the table is never used, or can't finish:
+    #   unused - (state, position) for patterns that never get to match alone
+    #   unreachable - states the start state never leads to
+    #   missing_eof - states where the input can't end
+    #   dead - reachable states which never lead to a state where it can
+    report = {key : [] for key in ['unknown', 'overlaps', 'late_eof', 'unused', 'unreachable', 'missing_eof', 'dead']}
+    if start_state not in transitions:
+        report['unknown'].append((None, start_state))
+
+    edges : dict[str, set[str]] = {}
+    accepting = set()
+    for state, state_transitions in transitions.items():
+        state_transitions = list(state_transitions)
+        edges[state] = set()
+        for i, expr in enumerate(state_transitions):
+            if expr[1] not in transitions:
+                report['unknown'].append((state, expr[1]))
+            if expr[0] == None:
+                if i == 0:
+                    accepting.add(state)
+                    edges[state].add(expr[1])
+                else:
+                    report['late_eof'].append((state, i))
+        if state not in accepting:
+            report['missing_eof'].append(state)
+
+        used = set()
+        for char in ANALYSED_CHARS:
+            matches = state_dispatch(state_transitions, char)
+            if len(matches) > 1:
+                report['overlaps'].append((state, char, matches))
+            elif len(matches) == 1:
+                used.add(matches[0])
+                edges[state].add(state_transitions[matches[0]][1])
+        for i, expr in enumerate(state_transitions):
+            if expr[0] != None and i not in used:
+                report['unused'].append((state, i))
+
+    reachable = set()
+    pending = [start_state] if start_state in transitions else []
+    while len(pending) > 0:
+        state = pending.pop()
+        if state in reachable:
+            continue
+        reachable.add(state)
+        pending.extend(other for other in edges[state] if other in transitions)
+    report['unreachable'] = [state for state in transitions if state not in reachable]
+
+    # walk backwards from the states where the input can end
+    finishing = set()
+    pending = list(accepting)
+    while len(pending) > 0:
+        state = pending.pop()
+        if state in finishing:
+            continue
+        finishing.add(state)
+        pending.extend(other for other in transitions if state in edges[other])
+    report['dead'] = [state for state in transitions if state in reachable and state not in finishing]
+
+    return report
+
+def check_transitions(transitions : dict[str, list[LexTransition]], start_state : str) -> dict[str, list]:
+    report = analyse(transitions, start_state)
+    problems = []
+    for state, next_state in report['unknown']:
+        problems.append(f"Unknown lexer state {next_state}" + ("" if state == None else f" (from {state})"))
+    for state, char, matches in report['overlaps']:
+        problems.append(f"Overlapping symbol definitions in {state}: transitions {matches} all match {char!r}")
+    for state, i in report['late_eof']:
+        problems.append(f"EOF transition {i} in {state} is never used, it has to come first")
+    if len(problems) > 0:
+        raise ValueError("\n".join(problems))
+    return report
+
+def minimise(transitions : dict[str, list[LexTransition]], start_state : str) -> tuple[dict[str, list[LexTransition]], dict[str, str]]:
+    # merges states which have the same patterns with the same actions, at
+    # EOF too, and go on to states which do too. returns the smaller table and
+    # merged state -> the state kept in its place
+    # states are compared by pattern rather than on ANALYSED_CHARS, since
+    # patterns which agree there can still differ elsewhere, e.g. \d and [0-9]
+    tables = {}
+    for state, state_transitions in transitions.items():
+        state_transitions = list(state_transitions)
+        eof = None
+        if len(state_transitions) > 0 and state_transitions[0][0] == None:
+            eof = (None, state_transitions[0][1], flatten_actions(state_transitions[0][2]))
+        # each character has one match, so the order of the rest doesn't matter
+        steps = sorted(((expr[0], expr[1], flatten_actions(expr[2])) for expr in state_transitions if expr[0] != None), key=lambda step : str(step[0]))
+        tables[state] = [eof] + steps
+
+    # start by splitting on the patterns and actions, then keep splitting on which
+    # group each step leads to until no group splits
+    def signature(state : str, group : dict[str, int]) -> tuple:
+        return tuple(None if step == None else (step[0], step[2], -1 if group == None else group[step[1]]) for step in tables[state])
+
+    group = None
+    count = 0
+    while True:
+        signatures = {}
+        next_group = {}
+        for state in transitions:
+            next_group[state] = signatures.setdefault(signature(state, group), len(signatures))
+        if len(signatures) == count:
+            break
+        group, count = next_group, len(signatures)
+
+    # the first state in each group stands in for it, except the start state
+    # always stands for its own
+    kept = {}
+    for state in [start_state] + list(transitions):
+        kept.setdefault(group[state], state)
+    merged = {state : kept[group[state]] for state in transitions if kept[group[state]] != state}
+
+    table = {}
+    for state, state_transitions in transitions.items():
+        if state in merged:
+            continue
+        table[state] = [(expr[0], merged.get(expr[1], expr[1]), expr[2]) for expr in state_transitions]
+    return table, merged
 
 class AbstractLexer():
-    def __init__(self, transitions : dict[str, list[LexTransition]], start_state : str):
+    def __init__(self, transitions : dict[str, list[LexTransition]], start_state : str, compiled : bool = True, scan_runs : bool = True, profile : bool = False, validate : bool = True, merge_states : bool = False):
         # self.ignore = '\n\r\t '
+        # a validated table has at most one match for each analysed character,
+        # so matching can stop at the first one
+        self.validated = validate or merge_states
+        self.report = check_transitions(transitions, start_state) if self.validated else None
+        self.merged : dict[str, str] = {}
+        if merge_states:
+            transitions, self.merged = minimise(transitions, start_state)
         self.token = ''
         self.tokens = []
+        self.drained = 0
+        # offset of the character being stepped, counted from the start of the input
+        self.pos = 0
+        self.offset = 0
+        # offset of the first character in self.token
+        self.token_start = 0
         self.transitions = transitions
+        self.start_state = start_state
         self.state = start_state
+        self.compiled = compiled
+        # profiling steps one character at a time, so it can't skip runs
+        self.profiling = profile
+        self.scan_runs = compiled and scan_runs and not profile
+        if compiled:
+            self.compile()
+        elif profile:
+            self.compile(precompute=False)
+        if profile:
+            self.reset_stats()
 
     @classmethod
     def make_push_token_as(cls, output_int : int) -> Callable[["AbstractLexer", str],None]:
@@ -20,6 +199,8 @@ class AbstractLexer():
 
     @classmethod
     def accumulate(cls, obj : "AbstractLexer", next_char : str):
+        if obj.token == "":
+            obj.token_start = obj.pos
         obj.token += next_char
 
     @classmethod
@@ -33,6 +214,167 @@ class AbstractLexer():
     def reset(self):
         self.token = ''
         self.tokens = []
+        self.drained = 0
+        self.pos = 0
+        self.offset = 0
+        self.token_start = 0
+        self.state = self.start_state
+
+    def compile(self, precompute : bool = True):
+        # turn the transitions into a DFA: one dict per state mapping a character
+        # to the transition it takes, so that stepping is a single lookup.
+        # without precompute the dispatch tables only fill in as characters are seen
+        self.patterns : dict[str, list[tuple[Pattern, str, tuple[LexTransitionFn]]]] = {}
+        self.dispatch : dict[str, dict[str, LexDispatch]] = {}
+        self.eof_actions : dict[str, tuple[LexTransitionFn]] = {}
+        # per state: a regex consuming a whole run of self-loop characters,
+        # and the set of characters which can start one
+        self.runs : dict[str, tuple[Pattern, set[str]]] = {}
+
+        for state, state_transitions in self.transitions.items():
+            self.patterns[state] = [
+                (re.compile(expr[0]), expr[1], flatten_actions(expr[2]))
+                for expr in state_transitions if expr[0] != None
+            ]
+            self.dispatch[state] = {}
+
+            # lex only ever looks at the first transition for EOF, but sets have no first element
+            if isinstance(state_transitions, (list, tuple)):
+                eof_candidates = state_transitions[:1]
+            else:
+                eof_candidates = state_transitions
+            for expr in eof_candidates:
+                if expr[0] == None:
+                    self.eof_actions[state] = flatten_actions(expr[2])
+
+            if not precompute:
+                continue
+
+            for char in PRECOMPUTED_CHARS:
+                try:
+                    self.resolve(state, char)
+                except ValueError:
+                    # no match or overlap - leave it for step to report if it happens
+                    pass
+
+            self.compile_runs(state)
+
+    def compile_runs(self, state : str):
+        # self-loops which only accumulate or do nothing leave the lexer exactly
+        # where it was, so a run of them can be consumed with one regex match
+        accumulated = []
+        skipped = []
+        for char, (next_state, actions) in self.dispatch[state].items():
+            if next_state != state:
+                continue
+            if len(actions) == 0:
+                skipped.append(char)
+            elif is_accumulate(actions):
+                accumulated.append(char)
+
+        groups = []
+        if len(accumulated) > 0:
+            groups.append(f"(?P<accumulate>{make_char_class(accumulated)})")
+        if len(skipped) > 0:
+            groups.append(f"(?P<skip>{make_char_class(skipped)})")
+        if len(groups) > 0:
+            self.runs[state] = (re.compile("|".join(groups)), set(accumulated + skipped))
+
+    def resolve(self, state : str, next_char : str) -> LexDispatch:
+        if state not in self.patterns:
+            raise ValueError(f"Unknown lexer state {state}")
+
+        found = None
+        first_match = self.validated and next_char < "\x80"
+        for pattern, next_state, actions in self.patterns[state]:
+            if pattern.match(next_char) != None:
+                if found != None:
+                    raise ValueError(f"Overlapping symbol definitions in {state}")
+                found = (next_state, actions)
+                if first_match:
+                    break
+
+        if found == None:
+            raise ValueError(f"No valid matches for next character in state {state}. Next character is \"{next_char}\"")
+
+        self.dispatch[state][next_char] = found
+        return found
+
+    def reset_stats(self):
+        # per state: [characters stepped, regex attempts, seconds]
+        self.state_counts = {state : [0, 0, 0.0] for state in self.patterns}
+        # per transition, in the order of self.patterns: [fired, regex attempts, seconds, actions run]
+        self.transition_counts = {state : [[0, 0, 0.0, 0] for _ in patterns] for state, patterns in self.patterns.items()}
+        # per state: [times EOF was lexed there, actions run]
+        self.eof_counts = {state : [0, 0] for state in self.patterns}
+
+    def step_profiled(self, next_char : str):
+        # the same matching as step, timing each pattern and the actions of
+        # the transition taken. a transition's seconds cover both
+        state = self.state
+        patterns = self.patterns[state]
+        counts = self.transition_counts[state]
+        state_start = perf_counter()
+
+        found = None
+        first_match = self.validated and next_char < "\x80"
+        attempts = 0
+        for i, (pattern, next_state, actions) in enumerate(patterns):
+            start = perf_counter()
+            matched = pattern.match(next_char) != None
+            counts[i][1] += 1
+            counts[i][2] += perf_counter() - start
+            attempts += 1
+            if matched:
+                if found != None:
+                    raise ValueError(f"Overlapping symbol definitions in {state}")
+                found = i
+                if first_match:
+                    break
+
+        if found == None:
+            raise ValueError(f"No valid matches for next character in state {state}. Next character is \"{next_char}\"")
+
+        start = perf_counter()
+        _, next_state, actions = patterns[found]
+        self.state = next_state
+        for fn in actions:
+            fn(self, next_char)
+        end = perf_counter()
+
+        counts[found][0] += 1
+        counts[found][2] += end - start
+        counts[found][3] += len(actions)
+        state_counts = self.state_counts[state]
+        state_counts[0] += 1
+        state_counts[1] += attempts
+        state_counts[2] += end - state_start
+
+    def stats(self) -> dict[str, dict]:
+        if not self.profiling:
+            raise ValueError("Stats are only kept when the lexer is made with profile=True")
+        out = {}
+        for state, patterns in self.patterns.items():
+            visits, attempts, seconds = self.state_counts[state]
+            out[state] = {
+                'visits': visits,
+                'attempts': attempts,
+                'seconds': seconds,
+                'eof': self.eof_counts[state][0],
+                'eof_actions': self.eof_counts[state][1],
+                'transitions': [
+                    {
+                        'pattern': pattern.pattern,
+                        'next_state': next_state,
+                        'fired': counts[0],
+                        'attempts': counts[1],
+                        'seconds': counts[2],
+                        'actions': counts[3]
+                    }
+                    for (pattern, next_state, _), counts in zip(patterns, self.transition_counts[state])
+                ]
+            }
+        return out
 
     def step(self, next_char : str):
         # if next_char in self.ignore:
@@ -41,6 +383,8 @@ class AbstractLexer():
 
         matches = 0
         state = self.state
+        # the table was checked for overlaps on these when it was built
+        first_match = self.validated and next_char < "\x80"
         for expr in self.transitions.get(state):
             if expr[0] != None and re.match(expr[0], next_char) != None:
                 matches += 1
@@ -56,6 +400,9 @@ class AbstractLexer():
                 else:
                     expr[2](self,next_char)
 
+                if first_match:
+                    break
+
         if matches == 0:
             raise ValueError(f"No valid matches for next character in state {self.state}. Next character is \"{next_char}\"")
     
@@ -67,19 +414,134 @@ class AbstractLexer():
             'rankdir=LR;',
             'node [shape=circle];'
         ]
+        # when profiling, label each edge with how often it fired and draw hot ones thicker
+        most_fired = 1
+        if self.profiling:
+            most_fired = max([1] + [counts[0] for state_counts in self.transition_counts.values() for counts in state_counts])
         for state in self.transitions:
+            i = 0
             for transition in self.transitions[state]:
-                lines.append(f'{state.replace("-","_")} -> {transition[1].replace("-","_")} ["label" = "{str(transition[0])}"];')
+                label = str(transition[0])
+                attributes = ""
+                if self.profiling:
+                    if transition[0] == None:
+                        fired = self.eof_counts[state][0]
+                    else:
+                        fired = self.transition_counts[state][i][0]
+                        i += 1
+                    label += f" ({fired})"
+                    attributes = f', "penwidth" = {1 + 4 * fired / most_fired:.2f}, "weight" = {fired}'
+                lines.append(f'{state.replace("-","_")} -> {transition[1].replace("-","_")} ["label" = "{label}"{attributes}];')
         lines.append('}')
 
         with open(outPath, "w") as f:
             for ln in lines:
                 f.write(f"{ln}\n")
 
+    def step_compiled(self, next_char : str):
+        entry = self.dispatch[self.state].get(next_char) or self.resolve(self.state, next_char)
+        self.state = entry[0]
+        for fn in entry[1]:
+            fn(self, next_char)
+
     def lex(self, input : str):
         self.reset()
-        for char in input:
-            self.step(char)
+        self.feed(input)
+        return self.lex_eof()
+
+    def lex_compact(self, input : str, kind_type : Callable[[int], int] = int) -> TokenArray:
+        # the same tokens, stored as arrays of kinds and offsets into input
+        self.reset()
+        self.tokens = TokenArray(input, self, kind_type)
+        self.feed(input)
+        return self.lex_eof()
+
+    def lex_iter(self, source : Union[TextIO, Iterable[str]], chunk_size : int = 65536) -> Iterator[LexToken]:
+        # lexes a file object or any iterable of string chunks, yielding tokens
+        # as soon as they are complete instead of collecting them all
+        self.reset()
+        if hasattr(source, "read"):
+            file = source
+            source = iter(lambda : file.read(chunk_size), "")
+
+        for chunk in source:
+            self.feed(chunk)
+            yield from self.drain()
+
+        self.lex_eof()
+        yield from self.drain()
+
+    def drain(self) -> list[LexToken]:
+        # hands over the tokens produced since the last drain. the newest token
+        # is kept in self.tokens because actions may look back at it
+        pending = self.tokens[self.drained:]
+        self.tokens = self.tokens[-1:]
+        self.drained = len(self.tokens)
+        return pending
+
+    def feed(self, input : str):
+        offset = self.offset
+        self.offset += len(input)
+
+        if self.profiling:
+            for i, char in enumerate(input, offset):
+                self.pos = i
+                self.step_profiled(char)
+            self.pos = self.offset
+            return
+
+        if not self.compiled:
+            for i, char in enumerate(input, offset):
+                self.pos = i
+                self.step(char)
+            self.pos = self.offset
+            return
+
+        dispatch = self.dispatch
+        if not self.scan_runs:
+            for i, char in enumerate(input, offset):
+                self.pos = i
+                entry = dispatch[self.state].get(char) or self.resolve(self.state, char)
+                self.state = entry[0]
+                for fn in entry[1]:
+                    fn(self, char)
+            self.pos = self.offset
+            return
+
+        runs = self.runs
+        i = 0
+        length = len(input)
+        while i < length:
+            char = input[i]
+            run = runs.get(self.state)
+            if run != None and char in run[1]:
+                match = run[0].match(input, i)
+                if match.lastgroup == "accumulate":
+                    if self.token == "":
+                        self.token_start = offset + i
+                    self.token += match.group()
+                i = match.end()
+                continue
+
+            self.pos = offset + i
+            entry = dispatch[self.state].get(char) or self.resolve(self.state, char)
+            self.state = entry[0]
+            for fn in entry[1]:
+                fn(self, char)
+            i += 1
+        self.pos = self.offset
+
+    def lex_eof(self):
+        if self.profiling and self.state in self.eof_counts:
+            self.eof_counts[self.state][0] += 1
+            self.eof_counts[self.state][1] += len(self.eof_actions.get(self.state, ()))
+
+        if self.compiled:
+            if self.state not in self.eof_actions:
+                raise ValueError(f"Cannot lex EOF from state {self.state}")
+            for fn in self.eof_actions[self.state]:
+                fn(self, "")
+            return self.tokens
 
         possible_eof = self.transitions.get(self.state)[0]
         
@@ -1,22 +1,89 @@
-from typing import Callable, Union, Iterable
-from lexer import LexToken
-import re
+from typing import Callable, Union, Iterable, Iterator, Optional
+from lexer import LexToken, flatten_actions
 
 # ParseTransitionFn
-# (parser, next_token)
-ParseTransitionFn = Callable[["AbstractParser",str],None]
+# (parser, next_token) - next_token is None at the end of the tokens
+ParseTransitionFn = Callable[["AbstractParser",Optional[LexToken]],None]
 # ParseTransition:
-# (token_id, next_state, actions)
-ParseTransition = tuple[tuple[int],str,Union[tuple[ParseTransitionFn], ParseTransitionFn]]
+# (token_ids, next_state, actions) - a token id of None is the end of the tokens
+ParseTransition = tuple[tuple[Optional[int]],str,Union[tuple[ParseTransitionFn], ParseTransitionFn]]
+# (next_state, actions) with the actions always flattened to a tuple
+ParseDispatch = tuple[str, tuple[ParseTransitionFn]]
 
+# a pushdown automaton over tokens. each state has a table indexed by token
+# kind, so a step is one list lookup whatever the number of transitions.
+# actions keep whatever they need on self.stack and self.output, and append
+# finished results to self.results
 class AbstractParser:
     def __init__(self, transitions : dict[str, list[ParseTransition]], start_state : str):
         self.stack = []
-        self.tape = []
+        self.output = []
+        self.results = []
         self.transitions = transitions
+        self.start_state = start_state
         self.current_state = start_state
+        self.compile()
 
-    def parse(self, tokens : Iterable[LexToken]):
-        self.tape = tokens
-        while len(self.tape) > 0:
-            self.transitions.get(self.current_state)
\ No newline at end of file
+    def compile(self):
+        size = 1 + max([kind for state_transitions in self.transitions.values() for ids, _, _ in state_transitions for kind in ids if kind != None], default=-1)
+        self.dispatch : dict[str, list[Optional[ParseDispatch]]] = {}
+        self.end_actions : dict[str, ParseDispatch] = {}
+        for state, state_transitions in self.transitions.items():
+            table = [None] * size
+            for ids, next_state, actions in state_transitions:
+                if next_state not in self.transitions:
+                    raise ValueError(f"Unknown parser state {next_state} (from {state})")
+                entry = (next_state, flatten_actions(actions))
+                for kind in ids:
+                    if kind == None:
+                        if state in self.end_actions:
+                            raise ValueError(f"Overlapping end transitions in {state}")
+                        self.end_actions[state] = entry
+                    elif table[kind] != None:
+                        raise ValueError(f"Overlapping transitions for token {kind} in {state}")
+                    else:
+                        table[kind] = entry
+            self.dispatch[state] = table
+        if self.start_state not in self.dispatch:
+            raise ValueError(f"Unknown parser state {self.start_state}")
+
+    def reset(self):
+        self.stack = []
+        self.output = []
+        self.results = []
+        self.current_state = self.start_state
+
+    def step(self, token : LexToken):
+        table = self.dispatch[self.current_state]
+        kind = token[0]
+        entry = table[kind] if 0 <= kind < len(table) else None
+        if entry == None:
+            raise ValueError(f"Unexpected {token[1]!r} in parser state {self.current_state}")
+        self.current_state = entry[0]
+        for fn in entry[1]:
+            fn(self, token)
+
+    def parse_end(self):
+        entry = self.end_actions.get(self.current_state)
+        if entry == None:
+            raise ValueError(f"Tokens can't end in parser state {self.current_state}")
+        self.current_state = entry[0]
+        for fn in entry[1]:
+            fn(self, None)
+
+    # pulls tokens one at a time, so with lex_iter as the source lexing and
+    # parsing run as one pipeline. results are yielded as soon as they're done
+    def parse_iter(self, tokens : Iterable[LexToken]) -> Iterator:
+        self.reset()
+        step = self.step
+        for token in tokens:
+            step(token)
+            if len(self.results) > 0:
+                yield from self.results
+                self.results = []
+        self.parse_end()
+        yield from self.results
+        self.results = []
+
+    def parse(self, tokens : Iterable[LexToken]) -> list:
+        return list(self.parse_iter(tokens))
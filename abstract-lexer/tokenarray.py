@@ -0,0 +1,98 @@
+# a compact token list: kinds and source offsets live in arrays, and the
+# text of a token is only sliced out of the source when it's asked for
+
+from array import array
+from typing import Callable, Iterator, Union
+
+class TokenArray():
+    def __init__(self, source : str, lexer = None, kind_type : Callable[[int], int] = int):
+        self.source = source
+        # the lexer is only needed while lexing, to know where each token was pushed
+        self.lexer = lexer
+        self.kind_type = kind_type
+        self.kinds = array('B')
+        self.starts = array('I')
+        self.ends = array('I')
+        # tokens whose text isn't a slice of the source, e.g. a '+' made from '--'
+        self.extras : dict[int, str] = {}
+
+    # tokens are pushed by lexer actions as (kind, text). the accumulated
+    # token starts where the lexer recorded its first character, and anything
+    # else is the character being stepped
+    def append(self, token : tuple[int, str]):
+        kind, text = token
+        lexer = self.lexer
+        if len(text) > 0 and text == lexer.token:
+            start = lexer.token_start
+        else:
+            start = lexer.pos
+        length = len(text)
+        if not self.source.startswith(text, start):
+            length = 0
+            self.extras[len(self.kinds)] = text
+
+        self.kinds.append(kind)
+        self.starts.append(start)
+        self.ends.append(start + length)
+
+    def kind(self, i : int) -> int:
+        return self.kind_type(self.kinds[i])
+
+    def lexeme(self, i : int) -> str:
+        if i < 0:
+            i += len(self.kinds)
+        text = self.extras.get(i)
+        if text != None:
+            return text
+        return self.source[self.starts[i]:self.ends[i]]
+
+    def span(self, i : int) -> tuple[int, int]:
+        return (self.starts[i], self.ends[i])
+
+    def __len__(self) -> int:
+        return len(self.kinds)
+
+    def __getitem__(self, key : Union[int, slice]):
+        if isinstance(key, slice):
+            start, stop, step = key.indices(len(self.kinds))
+            if step != 1:
+                raise ValueError("TokenArray slices can't have a step")
+            return TokenView(self, start, max(start, stop))
+        return (self.kind_type(self.kinds[key]), self.lexeme(key))
+
+    def __iter__(self) -> Iterator[tuple[int, str]]:
+        for i in range(len(self.kinds)):
+            yield self[i]
+
+    def __repr__(self) -> str:
+        return f"TokenArray({list(self)!r})"
+
+# a window onto a TokenArray, so parsers can slice without copying
+class TokenView():
+    def __init__(self, tokens : TokenArray, start : int, stop : int):
+        self.tokens = tokens
+        self.start = start
+        self.stop = stop
+
+    def __len__(self) -> int:
+        return self.stop - self.start
+
+    def __getitem__(self, key : Union[int, slice]):
+        length = self.stop - self.start
+        if isinstance(key, slice):
+            start, stop, step = key.indices(length)
+            if step != 1:
+                raise ValueError("TokenView slices can't have a step")
+            return TokenView(self.tokens, self.start + start, self.start + max(start, stop))
+        if key < 0:
+            key += length
+        if key < 0 or key >= length:
+            raise IndexError("TokenView index out of range")
+        return self.tokens[self.start + key]
+
+    def __iter__(self) -> Iterator[tuple[int, str]]:
+        for i in range(self.start, self.stop):
+            yield self.tokens[i]
+
+    def __repr__(self) -> str:
+        return f"TokenView({list(self)!r})"
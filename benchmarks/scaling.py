@@ -0,0 +1,196 @@
+# measures how every lexer, parser and evaluator scales with input size,
+# saves the results as JSON and compares them against a stored baseline
+# run from the benchmarks directory: python scaling.py
+
+from argparse import ArgumentParser
+from importlib.util import spec_from_file_location, module_from_spec
+from math import log
+from random import Random
+from time import perf_counter
+import json
+import platform
+import sys
+import tracemalloc
+
+sys.path.insert(1,"../abstract-lexer")
+sys.path.insert(1,"../infix-parser")
+sys.path.insert(1,"../infix-plus")
+
+from lexer import AbstractLexer
+from infix import InfixLexer, InfixParser, evaluate
+from bench_infix import make_expression
+from bench_lexer import make_ipl_source, make_spec_source
+import ipl
+from ipp import InfixPlusParser, PackratParser, PushdownParser
+
+def load_infix_spec():
+    spec = spec_from_file_location("infix_spec", "../abstract-lexer/infix-spec.py")
+    module = module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+def make_infix(size : int, depth : int, operators : str, seed : int = 0) -> str:
+    # chains expressions of a few terms, each nested up to depth brackets,
+    # until the text is about size characters long
+    rng = Random(seed)
+    parts = []
+    length = 0
+    while length < size:
+        part = make_expression(rng, 4, max_depth=depth, operators=operators)
+        parts.append(part)
+        length += len(part) + 3
+    return f" {operators[0]} ".join(parts)
+
+def make_stages(depth : int, operators : str) -> list:
+    # (name, setup, run): setup makes the input for a size and isn't timed
+    infix_lexer = InfixLexer()
+    infix_parser = InfixParser()
+    ipl_lexer = AbstractLexer(ipl.transitions, "start")
+    ipp_parser = InfixPlusParser()
+    packrat_parser = PackratParser()
+    pushdown_parser = PushdownParser()
+    infix_spec = load_infix_spec()
+    spec_lexer = AbstractLexer(infix_spec.transitions, "neutral")
+
+    infix_source = lambda size : make_infix(size, depth, operators)
+    infix_tokens = lambda size : infix_lexer.lex(infix_source(size))
+    return [
+        ("infix.lex", infix_source, infix_lexer.lex),
+        ("infix.parse", infix_tokens, infix_parser.parse),
+        ("infix.evaluate", lambda size : infix_parser.parse(infix_tokens(size)), evaluate),
+        ("abstract.lex.ipl", make_ipl_source, ipl_lexer.lex),
+        ("abstract.lex.spec", make_spec_source, spec_lexer.lex),
+        ("ipp.parse", lambda size : list(ipl_lexer.lex(make_ipl_source(size))), lambda tokens : list(ipp_parser.parse_stream(tokens))),
+        ("ipp.packrat", lambda size : list(ipl_lexer.lex(make_ipl_source(size))), lambda tokens : list(packrat_parser.parse_lines(tokens))),
+        ("ipp.pushdown", lambda size : list(ipl_lexer.lex(make_ipl_source(size))), lambda tokens : pushdown_parser.parse(tokens)),
+    ]
+
+def measure(fn, data, repeats : int) -> dict:
+    best = None
+    for _ in range(repeats):
+        start = perf_counter()
+        fn(data)
+        elapsed = perf_counter() - start
+        if best == None or elapsed < best:
+            best = elapsed
+
+    # tracing slows everything down, so memory gets a run of its own
+    tracemalloc.start()
+    fn(data)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return {'seconds': best, 'peak_bytes': peak}
+
+# the slope of log(time) against log(size): about 1 for linear stages and
+# 2 for quadratic ones, whatever machine it runs on
+def growth(sizes : list[int], seconds : list[float]) -> float:
+    if len(sizes) < 2 or seconds[0] <= 0:
+        return 0.0
+    return log(seconds[-1] / seconds[0]) / log(sizes[-1] / sizes[0])
+
+def run(sizes : list[int], repeats : int, depth : int, operators : str, only : list[str]) -> dict:
+    results = {}
+    for name, setup, fn in make_stages(depth, operators):
+        if len(only) > 0 and name not in only:
+            continue
+        runs = {}
+        for size in sizes:
+            runs[str(size)] = measure(fn, setup(size), repeats)
+            print(f"{name:<20}{size:>10}{runs[str(size)]['seconds']:>12.4f}s{runs[str(size)]['peak_bytes'] / 1e6:>10.2f}MB")
+        results[name] = {
+            'sizes': runs,
+            'growth': growth(sizes, [runs[str(size)]['seconds'] for size in sizes])
+        }
+        print(f"{name:<20}{'growth':>10}{results[name]['growth']:>12.2f}")
+    return results
+
+def compare(results : dict, baseline : dict, tolerance : float, growth_tolerance : float, same_config : bool = True, min_slowdown : float = 0.005) -> tuple[list[str], list[str]]:
+    # (regressions, stages the baseline has nothing for). runs of a
+    # millisecond or so double from noise alone, so a time only counts as a
+    # regression if it also got min_slowdown seconds slower
+    regressions = []
+    missing = []
+    for name, result in results['stages'].items():
+        old = baseline['stages'].get(name)
+        if old == None:
+            missing.append(name)
+            continue
+        for size, measured in result['sizes'].items():
+            if not same_config or size not in old['sizes']:
+                continue
+            for metric in ('seconds', 'peak_bytes'):
+                before = old['sizes'][size][metric]
+                if metric == 'seconds' and measured[metric] - before < min_slowdown:
+                    continue
+                if before > 0 and measured[metric] > before * tolerance:
+                    regressions.append(f"{name} at {size}: {metric} went from {before:.4g} to {measured[metric]:.4g}")
+        if result['growth'] > old['growth'] + growth_tolerance:
+            regressions.append(f"{name}: growth went from {old['growth']:.2f} to {result['growth']:.2f}")
+    return regressions, missing
+
+if __name__ == "__main__":
+    arg_parser = ArgumentParser(prog="Scaling Benchmarks")
+    arg_parser.add_argument('-s', '--sizes', nargs='+', type=int, default=[1000, 4000, 16000])
+    arg_parser.add_argument('-r', '--repeats', type=int, default=3)
+    arg_parser.add_argument('-d', '--depth', type=int, default=3, help="how deeply infix expressions nest brackets")
+    arg_parser.add_argument('-m', '--operators', default="+-*/", help="operators infix expressions are made from")
+    arg_parser.add_argument('-t', '--stages', nargs='+', default=[], help="only run these stages")
+    arg_parser.add_argument('-o', '--output', default="results.json")
+    arg_parser.add_argument('-b', '--baseline', default="baseline.json")
+    arg_parser.add_argument('--save-baseline', action='store_true', help="store these results as the new baseline, with -t only those stages")
+    arg_parser.add_argument('--tolerance', type=float, default=2.0, help="how many times slower or bigger a run can be")
+    arg_parser.add_argument('--min-slowdown', type=float, default=0.005, help="seconds a run has to slow down by before it counts")
+    arg_parser.add_argument('--growth-tolerance', type=float, default=0.3, help="how much a stage's growth can rise")
+
+    args = arg_parser.parse_args(sys.argv[1:])
+
+    # evaluate and the reduce parser recurse once per nesting level or operator
+    sys.setrecursionlimit(1000000)
+
+    config = {'sizes': args.sizes, 'depth': args.depth, 'operators': args.operators}
+    results = {
+        'config': config,
+        'python': platform.python_version(),
+        'stages': run(args.sizes, args.repeats, args.depth, args.operators, args.stages)
+    }
+
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
+
+    if args.save_baseline:
+        saved = results
+        # with only some stages run, the others keep their baseline
+        if len(args.stages) > 0:
+            try:
+                with open(args.baseline) as f:
+                    saved = json.load(f)
+            except FileNotFoundError:
+                pass
+            if saved['config'] != config:
+                print(f"The baseline at {args.baseline} was made with different sizes or generator settings, run every stage to replace it")
+                sys.exit(1)
+            saved['stages'].update(results['stages'])
+        with open(args.baseline, "w") as f:
+            json.dump(saved, f, indent=2)
+        print(f"Saved the baseline to {args.baseline}")
+        sys.exit(0)
+
+    try:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    except FileNotFoundError:
+        print(f"No baseline at {args.baseline}, run with --save-baseline to make one")
+        sys.exit(0)
+
+    same_config = baseline['config'] == config
+    if not same_config:
+        print("The baseline was made with different sizes or generator settings, so only growth is compared")
+
+    regressions, missing = compare(results, baseline, args.tolerance, args.growth_tolerance, same_config, args.min_slowdown)
+    for name in missing:
+        print(f"NO BASELINE for {name}, run with -t {name} --save-baseline to add it")
+    for regression in regressions:
+        print(f"REGRESSION {regression}")
+    if len(regressions) > 0:
+        sys.exit(1)
+    print("No regressions against the baseline")
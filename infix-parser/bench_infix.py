@@ -0,0 +1,261 @@
+# compares the infix engines across input sizes, checking they agree
+# run from the infix-parser directory: python bench_infix.py
+
+from argparse import ArgumentParser
+from random import Random
+from time import perf_counter
+import sys
+import tracemalloc
+
+from infix import InfixLexer, InfixCursorLexer, InfixParser, InfixClimbingParser, ParseNode, FlatAST, evaluate, compile_to_callable, optimise, count_instructions, to_float32, fold_ops, minus
+from cache import ExpressionCache
+
+def make_number(rng : Random) -> str:
+    # no zeros, so evaluating never divides by zero
+    number = str(rng.randint(1, 1000))
+    if rng.random() < 0.3:
+        number += "." + str(rng.randint(0, 99))
+    return number
+
+def make_term(rng : Random, depth : int, max_depth : int) -> str:
+    roll = rng.random()
+    if roll < 0.15 and depth < max_depth:
+        # InfixParser mistakes a bracket holding only a negated term for a minus
+        # sign (ParseNode compares equal to its token), so keep two or more terms
+        term = "(" + make_expression(rng, rng.randint(2, 4), depth + 1, max_depth) + ")"
+    else:
+        term = make_number(rng)
+    if rng.random() < 0.15:
+        term = "-" * rng.randint(1, 3) + term
+    return term
+
+def make_expression(rng : Random, terms : int, depth : int = 0, max_depth : int = 3, operators : str = "+-*/") -> str:
+    out = make_term(rng, depth, max_depth)
+    for _ in range(terms - 1):
+        out += rng.choice([" ", ""]) + rng.choice(operators) + rng.choice([" ", ""]) + make_term(rng, depth, max_depth)
+    return out
+
+def make_sized_expression(size : int, seed : int = 0) -> str:
+    # grows an expression to roughly size characters
+    rng = Random(seed)
+    parts = [make_expression(rng, 4)]
+    length = len(parts[0])
+    while length < size:
+        part = make_expression(rng, 4)
+        parts.append(part)
+        length += len(part) + 3
+    return " + ".join(parts)
+
+def best_time(fn, repeats : int):
+    best = None
+    result = None
+    for _ in range(repeats):
+        start = perf_counter()
+        result = fn()
+        elapsed = perf_counter() - start
+        if best == None or elapsed < best:
+            best = elapsed
+    return best, result
+
+def tree(node) -> tuple:
+    # ParseNode equality only looks at the token, so compare whole structures
+    if isinstance(node, ParseNode):
+        return (node.token, tuple(tree(child) for child in node.children))
+    return node
+
+def check_parsers(count : int, seed : int = 0):
+    rng = Random(seed)
+    lexer = InfixCursorLexer()
+    reduce = InfixParser()
+    climbing = InfixClimbingParser()
+    for _ in range(count):
+        expression = make_expression(rng, rng.randint(1, 12), max_depth=rng.randint(0, 4), operators=rng.choice(["+-*/", "+-*/^", "*/", "+-"]))
+        tokens = lexer.lex(expression)
+        if tree(reduce.parse(tokens)) != tree(climbing.parse(tokens)):
+            raise AssertionError(f"parsers disagree on {expression}")
+    print(f"parsers agree on {count} random expressions")
+
+def compare_parsers(sizes : list[int], repeats : int):
+    lexer = InfixCursorLexer()
+    reduce = InfixParser()
+    climbing = InfixClimbingParser()
+    print(f"{'chars':>10}{'tokens':>10}{'reduce':>12}{'climbing':>12}{'speedup':>10}")
+    for size in sizes:
+        tokens = list(lexer.lex(make_sized_expression(size)))
+        reduce_time, reduce_tree = best_time(lambda : reduce.parse(tokens), repeats)
+        climbing_time, climbing_tree = best_time(lambda : climbing.parse(tokens), repeats)
+        if tree(reduce_tree) != tree(climbing_tree):
+            raise AssertionError(f"parsers disagree at {size} characters")
+        print(f"{size:>10}{len(tokens):>10}{reduce_time:>12.4f}{climbing_time:>12.4f}{reduce_time / climbing_time:>9.1f}x")
+
+def allocated(fn):
+    # bytes still allocated by fn's result
+    tracemalloc.start()
+    result = fn()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return size, result
+
+def compare_flat(sizes : list[int], repeats : int):
+    lexer = InfixCursorLexer()
+    parser = InfixClimbingParser()
+    # empty input parses to None, which flattens to no ops and evaluates to None
+    empty = FlatAST.from_tree(parser.parse(lexer.lex("")))
+    if len(empty) != 0 or evaluate(empty) != None or empty.to_tree() != None:
+        raise AssertionError("the empty tree doesn't flatten to an empty FlatAST")
+    print(f"{'chars':>10}{'nodes':>10}{'tree KB':>10}{'flat KB':>10}{'tree eval':>12}{'flat eval':>12}")
+    for size in sizes:
+        tokens = lexer.lex(make_sized_expression(size))
+        tree_bytes, root = allocated(lambda : parser.parse(tokens))
+        flat_bytes, flat = allocated(lambda : FlatAST.from_tree(root))
+        tree_time, tree_value = best_time(lambda : evaluate(root), repeats)
+        flat_time, flat_value = best_time(lambda : evaluate(flat), repeats)
+        if tree_value != flat_value:
+            raise AssertionError(f"flat evaluation disagrees at {size} characters")
+        if tree(flat.to_tree()) != tree(root):
+            raise AssertionError(f"flat round trip changes the tree at {size} characters")
+        print(f"{size:>10}{len(flat):>10}{tree_bytes / 1000:>10.1f}{flat_bytes / 1000:>10.1f}{tree_time:>12.4f}{flat_time:>12.4f}")
+
+def outcome(fn):
+    # the value, or the type of error raised, so failures can be compared too
+    try:
+        return fn()
+    except ArithmeticError as e:
+        return type(e)
+
+def check_callables(count : int, seed : int = 0):
+    rng = Random(seed)
+    lexer = InfixCursorLexer()
+    parser = InfixClimbingParser()
+    for _ in range(count):
+        expression = make_expression(rng, rng.randint(1, 12), max_depth=rng.randint(0, 4), operators=rng.choice(["+-*/", "+-*/^"]))
+        root = parser.parse(lexer.lex(expression))
+        expected = outcome(lambda : evaluate(root))
+        value = outcome(compile_to_callable(root))
+        # nan != nan, and negative numbers to fractional powers are complex
+        if value != expected and not (value != value and expected != expected):
+            raise AssertionError(f"compiled callable disagrees on {expression}")
+    if compile_to_callable(parser.parse(lexer.lex("")))() != None:
+        raise AssertionError("the compiled callable for empty input doesn't return None")
+    print(f"compiled callables agree on {count} random expressions")
+
+def compare_callables(sizes : list[int], evaluations : int):
+    lexer = InfixCursorLexer()
+    parser = InfixClimbingParser()
+    print(f"{'chars':>10}{'compile s':>12}{'tree/s':>12}{'flat/s':>12}{'callable/s':>12}")
+    for size in sizes:
+        root = parser.parse(lexer.lex(make_sized_expression(size)))
+        flat = FlatAST.from_tree(root)
+
+        start = perf_counter()
+        fn = compile_to_callable(root)
+        compile_time = perf_counter() - start
+
+        rates = []
+        for evaluator in (lambda : evaluate(root), lambda : evaluate(flat), fn):
+            start = perf_counter()
+            for _ in range(evaluations):
+                evaluator()
+            rates.append(evaluations / (perf_counter() - start))
+        print(f"{size:>10}{compile_time:>12.4f}{rates[0]:>12.0f}{rates[1]:>12.0f}{rates[2]:>12.0f}")
+
+def compare_lexers(sizes : list[int], repeats : int):
+    tape = InfixLexer()
+    cursor = InfixCursorLexer()
+    print(f"{'chars':>10}{'tokens':>10}{'tape':>12}{'cursor':>12}{'speedup':>10}")
+    for size in sizes:
+        expression = make_sized_expression(size)
+        tape_time, tape_tokens = best_time(lambda : list(tape.lex(expression)), repeats)
+        cursor_time, cursor_tokens = best_time(lambda : list(cursor.lex(expression)), repeats)
+        if tape_tokens != cursor_tokens:
+            raise AssertionError(f"cursor lexer disagrees at {size} characters")
+        print(f"{len(expression):>10}{len(cursor_tokens):>10}{tape_time:>12.4f}{cursor_time:>12.4f}{tape_time / cursor_time:>9.1f}x")
+
+def evaluate_float32(node) -> float:
+    # evaluates the way the compiled program does, rounding every step to a float32
+    if isinstance(node, str):
+        return to_float32(float(node))
+    values = [evaluate_float32(child) for child in node.children]
+    if node.token == minus:
+        return -values[0]
+    return to_float32(fold_ops[node.token](values[0], values[1]))
+
+def check_optimise(count : int, seed : int = 0):
+    rng = Random(seed)
+    lexer = InfixCursorLexer()
+    parser = InfixClimbingParser()
+    for _ in range(count):
+        expression = make_expression(rng, rng.randint(1, 12), max_depth=rng.randint(0, 4), operators="+-*/")
+        root = parser.parse(lexer.lex(expression))
+        # simplification and cse are exact in any precision
+        if outcome(lambda : evaluate(optimise(root, fold=False))) != outcome(lambda : evaluate(root)):
+            raise AssertionError(f"optimising without folding changed the value of {expression}")
+        folded = optimise(root)
+        if isinstance(folded, str) and to_float32(float(folded)) != outcome(lambda : evaluate_float32(root)):
+            raise AssertionError(f"folding changed the value of {expression}")
+    print(f"optimised trees agree on {count} random expressions")
+
+def compare_optimise(sizes : list[int], repeats : int):
+    lexer = InfixCursorLexer()
+    parser = InfixClimbingParser()
+    print(f"{'chars':>10}{'parsed':>10}{'no fold':>10}{'folded':>10}{'optimise s':>12}")
+    for size in sizes:
+        root = parser.parse(lexer.lex(make_sized_expression(size)))
+        optimise_time, folded = best_time(lambda : optimise(root), repeats)
+        print(f"{size:>10}{count_instructions(root):>10}{count_instructions(optimise(root, fold=False)):>10}{count_instructions(folded):>10}{optimise_time:>12.4f}")
+
+def compare_cache(requests : int, distinct : int, seed : int = 0):
+    # a skewed workload: a few expressions make up most of the traffic
+    rng = Random(seed)
+    expressions = [make_expression(rng, rng.randint(2, 12), operators="+-*/") for _ in range(distinct)]
+    weights = [1 / (i + 1) for i in range(distinct)]
+    workload = rng.choices(expressions, weights, k=requests)
+    # empty lines have no tree, and evaluate to None either way
+    workload[:2] = ["", "   "]
+    lexer = InfixLexer()
+    parser = InfixParser()
+
+    start = perf_counter()
+    expected = [outcome(lambda : evaluate(parser.parse(lexer.lex(text)))) for text in workload]
+    uncached_time = perf_counter() - start
+
+    cache = ExpressionCache(lexer, parser, max_entries=max(1, distinct // 10))
+    start = perf_counter()
+    values = [outcome(lambda : cache.evaluate(text)) for text in workload]
+    cached_time = perf_counter() - start
+
+    if values != expected:
+        raise AssertionError("cached evaluation disagrees with the pipeline")
+    print(f"{requests} requests over {distinct} expressions, cache holds {cache.max_entries}")
+    print(f"uncached {uncached_time:.4f}s, cached {cached_time:.4f}s, {uncached_time / cached_time:.1f}x")
+    print(cache.stats())
+
+if __name__ == "__main__":
+    arg_parser = ArgumentParser(prog="Infix Benchmark")
+    arg_parser.add_argument('-s', '--sizes', nargs='+', type=int, default=[1000, 10000, 100000])
+    arg_parser.add_argument('-r', '--repeats', type=int, default=3)
+    arg_parser.add_argument('-b', '--bench', choices=['lexer', 'parser', 'flat', 'callable', 'cache', 'optimise'], default='lexer')
+    arg_parser.add_argument('-c', '--check', type=int, default=2000, help="random expressions for the differential check")
+    arg_parser.add_argument('-e', '--evaluations', type=int, default=1000, help="repeated evaluations per expression")
+
+    args = arg_parser.parse_args(sys.argv[1:])
+
+    if args.bench == 'lexer':
+        compare_lexers(args.sizes, args.repeats)
+    elif args.bench == 'parser':
+        check_parsers(args.check)
+        compare_parsers(args.sizes, args.repeats)
+    elif args.bench == 'flat':
+        # evaluating a long tree recurses once per operator
+        sys.setrecursionlimit(1000000)
+        compare_flat(args.sizes, args.repeats)
+    elif args.bench == 'callable':
+        sys.setrecursionlimit(1000000)
+        check_callables(args.check)
+        compare_callables(args.sizes, args.evaluations)
+    elif args.bench == 'optimise':
+        sys.setrecursionlimit(1000000)
+        check_optimise(args.check)
+        compare_optimise(args.sizes, args.repeats)
+    elif args.bench == 'cache':
+        compare_cache(args.evaluations * 20, args.check)
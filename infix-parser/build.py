@@ -0,0 +1,57 @@
+# runs llc and the linker on a .ll file, keeping each binary in a cache keyed
+# by a hash of the IR and the toolchain, so unchanged inputs skip both
+
+from hashlib import sha256
+import os
+import shutil
+import subprocess
+
+CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "__buildcache__")
+
+tool_identities : dict[str, str] = {}
+
+def tool_identity(tool : str) -> str:
+    # where the tool resolves to and what it says its version is, so
+    # upgrading llc or the compiler makes new keys. a tool which can't be run
+    # is just its name, and the build fails on it anyway
+    identity = tool_identities.get(tool)
+    if identity != None:
+        return identity
+    path = shutil.which(tool)
+    identity = tool
+    if path != None:
+        try:
+            version = subprocess.run([path, "--version"], capture_output=True, text=True, check=True).stdout
+            identity = f"{os.path.realpath(path)}\0{version}"
+        except (OSError, subprocess.CalledProcessError):
+            identity = os.path.realpath(path)
+    tool_identities[tool] = identity
+    return identity
+
+def build_key(ir : str, llc : str, cc : str) -> str:
+    return sha256("\0".join([tool_identity(llc), tool_identity(cc), ir]).encode("utf-8")).hexdigest()[:32]
+
+def build(ll_path : str, out_path : str, llc : str = "llc", cc : str = "clang", cache_dir : str = CACHE_DIR) -> bool:
+    # returns True if the binary came from the cache
+    with open(ll_path) as f:
+        ir = f.read()
+    cached = os.path.join(cache_dir, build_key(ir, llc, cc))
+
+    if os.path.exists(cached):
+        shutil.copy2(cached, out_path)
+        return True
+
+    object_path = f"{out_path}.o"
+    try:
+        subprocess.run([llc, "-filetype=obj", ll_path, "-o", object_path], check=True)
+        subprocess.run([cc, object_path, "-no-pie", "-o", out_path], check=True)
+    finally:
+        if os.path.exists(object_path):
+            os.remove(object_path)
+
+    os.makedirs(cache_dir, exist_ok=True)
+    # copy then rename, so another build never sees half a binary
+    temp_path = f"{cached}.{os.getpid()}.tmp"
+    shutil.copy2(out_path, temp_path)
+    os.replace(temp_path, cached)
+    return False
@@ -0,0 +1,108 @@
+# evaluates a file of expressions, one per line, spreading chunks of lines
+# over a pool of processes. output keeps the input order, one line per line,
+# and an invalid line only produces an error for that line
+# python bulk.py -i expressions.txt -o results.txt
+
+from argparse import ArgumentParser
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+from typing import Iterable, Iterator, TextIO
+import os
+import sys
+
+from infix import InfixLexer, InfixCursorLexer, InfixParser, InfixClimbingParser, evaluate
+from cache import ExpressionCache
+
+# each worker process builds its pipeline once, in init_worker
+worker_cache : ExpressionCache = None
+
+def make_cache(lexer : str, parser : str, cache_entries : int) -> ExpressionCache:
+    luthor = InfixCursorLexer() if lexer == 'cursor' else InfixLexer()
+    parser = InfixClimbingParser() if parser == 'climbing' else InfixParser()
+    # with no entries the cache still runs the pipeline, it just keeps nothing
+    return ExpressionCache(luthor, parser, max_entries=cache_entries)
+
+def init_worker(lexer : str, parser : str, cache_entries : int):
+    global worker_cache
+    worker_cache = make_cache(lexer, parser, cache_entries)
+
+def evaluate_line(cache : ExpressionCache, line : str) -> tuple[bool, str]:
+    # (ok, value or error message)
+    if line.strip() == "":
+        return True, ""
+    try:
+        return True, str(evaluate(cache.parse(line)))
+    # the parsers don't only raise ValueError on bad input, e.g. the reduce
+    # parser raises IndexError on "1+", and one line must not stop the rest
+    except Exception as e:
+        return False, f"{type(e).__name__}: {e}"
+
+def evaluate_chunk(lines : list[str]) -> list[tuple[bool, str]]:
+    return [evaluate_line(worker_cache, line) for line in lines]
+
+def read_chunks(source : TextIO, chunk_size : int) -> Iterator[list[str]]:
+    while True:
+        chunk = [line.rstrip("\r\n") for line in islice(source, chunk_size)]
+        if len(chunk) == 0:
+            return
+        yield chunk
+
+def evaluate_chunks(chunks : Iterable[list[str]], workers : int, lexer : str = 'tape', parser : str = 'reduce', cache_entries : int = 1024) -> Iterator[list[tuple[bool, str]]]:
+    # results come back a chunk at a time, in the order the chunks were read
+    if workers <= 1:
+        init_worker(lexer, parser, cache_entries)
+        for chunk in chunks:
+            yield evaluate_chunk(chunk)
+        return
+
+    with ProcessPoolExecutor(workers, initializer=init_worker, initargs=(lexer, parser, cache_entries)) as pool:
+        # only a couple of chunks per worker are read ahead, so memory is
+        # bounded by the chunk size rather than the file size
+        pending = deque()
+        for chunk in chunks:
+            pending.append(pool.submit(evaluate_chunk, chunk))
+            if len(pending) >= workers * 2:
+                yield pending.popleft().result()
+        while len(pending) > 0:
+            yield pending.popleft().result()
+
+if __name__ == "__main__":
+    arg_parser = ArgumentParser(prog="Bulk Calculator")
+    arg_parser.add_argument('-i', '--input', default="-", help="file of expressions, or - for stdin")
+    arg_parser.add_argument('-o', '--output', default="-", help="file for the results, or - for stdout")
+    arg_parser.add_argument('-w', '--workers', type=int, default=os.cpu_count(), help="processes to use, 1 runs in this one")
+    arg_parser.add_argument('-n', '--chunk-size', type=int, default=10000, help="lines sent to a worker at once")
+    arg_parser.add_argument('-l', '--lexer', choices=['tape', 'cursor'], default='cursor')
+    arg_parser.add_argument('-p', '--parser', choices=['reduce', 'climbing'], default='climbing')
+    arg_parser.add_argument('-e', '--cache-entries', type=int, default=1024, help="expressions each worker keeps parsed")
+
+    args = arg_parser.parse_args(sys.argv[1:])
+
+    # evaluate recurses once per operator on long expressions
+    sys.setrecursionlimit(100000)
+
+    source = sys.stdin if args.input == "-" else open(args.input)
+    out = sys.stdout if args.output == "-" else open(args.output, "w")
+
+    line_no = 0
+    errors = 0
+    try:
+        for results in evaluate_chunks(read_chunks(source, args.chunk_size), args.workers, args.lexer, args.parser, args.cache_entries):
+            for ok, text in results:
+                line_no += 1
+                if ok:
+                    out.write(f"{text}\n")
+                else:
+                    errors += 1
+                    out.write("\n")
+                    print(f"Line {line_no}: {text}", file=sys.stderr)
+    finally:
+        if source is not sys.stdin:
+            source.close()
+        if out is not sys.stdout:
+            out.close()
+
+    print(f"Evaluated {line_no} lines, {errors} with errors.", file=sys.stderr)
+    if errors > 0:
+        sys.exit(1)
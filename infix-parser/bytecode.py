@@ -0,0 +1,43 @@
+# compiles calculator expressions to bytecode for the register VM in infix-vm.
+# run from the infix-parser directory, or put ../infix-vm on the path
+import sys
+
+sys.path.insert(1,"../infix-vm")
+
+from infix import FlatAST, FlatOp
+from vm import Bytecode, BytecodeBuilder, Op, VM
+
+vm_ops = {
+    FlatOp.ADD: Op.ADD,
+    FlatOp.DIVIDE: Op.DIVIDE,
+    FlatOp.MULTIPLY: Op.MULTIPLY,
+    FlatOp.POWER: Op.POWER
+}
+
+# the flat form is already in postfix order, so each operator's result goes
+# in the temporary for its depth on the operand stack. the empty tree
+# gives a program with no output, which evaluate_bytecode takes as None
+def compile_bytecode(node) -> Bytecode:
+    flat = node if isinstance(node, FlatAST) else FlatAST.from_tree(node)
+    builder = BytecodeBuilder()
+    if len(flat) == 0:
+        return builder.finish()
+    stack = []
+    for op, arg in zip(flat.ops, flat.args):
+        if op == FlatOp.CONST:
+            stack.append(builder.const(flat.consts[arg]))
+            continue
+        if op == FlatOp.NEGATE:
+            dst = builder.temp(len(stack) - 1)
+            builder.emit(Op.NEGATE, dst, stack[-1])
+        else:
+            right = stack.pop()
+            dst = builder.temp(len(stack) - 1)
+            builder.emit(vm_ops[op], dst, stack[-1], right)
+        stack[-1] = dst
+    builder.output(stack[0])
+    return builder.finish()
+
+def evaluate_bytecode(bytecode : Bytecode) -> float:
+    outputs = VM(bytecode).run()
+    return outputs[0] if len(outputs) > 0 else None
@@ -0,0 +1,106 @@
+# an LRU cache in front of lex -> parse, for traffic which repeats the same
+# expressions. entries hold the tree and, once asked for, a compiled callable
+
+from collections import OrderedDict
+from typing import Callable, Union
+import re
+import sys
+
+from infix import InfixLexer, InfixParser, ParseNode, compile_to_callable
+
+# rough cost of one parse node with its children list, for the byte bound
+NODE_BYTES = 120
+
+inner_space = re.compile(r"\s+")
+
+# both lexers ignore whitespace, except that trailing whitespace after a minus
+# is an error, so keep one trailing space if there was any
+def normalise(text : str) -> str:
+    stripped = text.rstrip()
+    key = inner_space.sub("", stripped)
+    if len(stripped) != len(text):
+        key += " "
+    return key
+
+def count_nodes(node) -> int:
+    count = 0
+    stack = [node]
+    while len(stack) > 0:
+        node = stack.pop()
+        count += 1
+        if isinstance(node, ParseNode):
+            stack.extend(node.children)
+    return count
+
+class CacheEntry():
+    def __init__(self, ast : Union[str, ParseNode], size : int):
+        self.ast = ast
+        self.fn : Callable[[], float] = None
+        self.size = size
+
+class ExpressionCache():
+    def __init__(self, lexer = None, parser = None, max_entries : int = 1024, max_bytes : int = 1 << 22):
+        self.lexer = InfixLexer() if lexer == None else lexer
+        self.parser = InfixParser() if parser == None else parser
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.entries : OrderedDict[str, CacheEntry] = OrderedDict()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def entry(self, text : str) -> CacheEntry:
+        key = normalise(text)
+        entry = self.entries.get(key)
+        if entry != None:
+            self.hits += 1
+            self.entries.move_to_end(key)
+            return entry
+
+        self.misses += 1
+        # invalid input raises here, so errors are never cached
+        ast = self.parser.parse(self.lexer.lex(text))
+        entry = CacheEntry(ast, sys.getsizeof(key) + count_nodes(ast) * NODE_BYTES)
+        if self.max_entries > 0 and entry.size <= self.max_bytes:
+            self.entries[key] = entry
+            self.bytes += entry.size
+            self.evict()
+        return entry
+
+    def evict(self):
+        while len(self.entries) > self.max_entries or self.bytes > self.max_bytes:
+            _, entry = self.entries.popitem(last=False)
+            self.bytes -= entry.size
+            self.evictions += 1
+
+    def parse(self, text : str) -> Union[str, ParseNode]:
+        return self.entry(text).ast
+
+    def evaluator(self, text : str) -> Callable[[], float]:
+        entry = self.entry(text)
+        if entry.fn == None:
+            entry.fn = compile_to_callable(entry.ast)
+        return entry.fn
+
+    def evaluate(self, text : str) -> float:
+        return self.evaluator(text)()
+
+    def clear(self):
+        self.entries.clear()
+        self.bytes = 0
+
+    def stats(self) -> dict[str, int]:
+        return {
+            'entries': len(self.entries),
+            'bytes': self.bytes,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions
+        }
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def __contains__(self, text : str) -> bool:
+        return normalise(text) in self.entries
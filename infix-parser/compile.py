@@ -1,8 +1,66 @@
-from infix import InfixLexer, InfixParser, compile
+from infix import InfixLexer, InfixCursorLexer, InfixParser, InfixClimbingParser, compile, compile_batch, optimise, count_instructions
+from build import build
+from argparse import ArgumentParser
 import subprocess
+import sys
 
-luthor = InfixLexer()
-parser = InfixParser()
+arg_parser = ArgumentParser(prog="Del's infix compiler")
+arg_parser.add_argument('-l', '--lexer', choices=['tape', 'cursor'], default='tape')
+arg_parser.add_argument('-p', '--parser', choices=['reduce', 'climbing'], default='reduce')
+arg_parser.add_argument('-n', '--no-optimise', action='store_true', help="emit one instruction per operator, as parsed")
+arg_parser.add_argument('-s', '--skip', action='append', choices=['fold', 'simplify', 'cse'], default=[], help="leave out one optimisation")
+arg_parser.add_argument('-b', '--batch', help="file of expressions, one per line, to compile into one program")
+arg_parser.add_argument('-o', '--output', help="program to write in batch mode")
+arg_parser.add_argument('--cc', default="clang", help="compiler used to link")
+args = arg_parser.parse_args(sys.argv[1:])
+
+luthor = InfixCursorLexer() if args.lexer == 'cursor' else InfixLexer()
+parser = InfixClimbingParser() if args.parser == 'climbing' else InfixParser()
+
+def prepare(input_str : str):
+    tokens = luthor.lex(input_str)
+    ast = parser.parse(tokens)
+    before = count_instructions(ast)
+    if not args.no_optimise:
+        ast = optimise(ast, 'fold' not in args.skip, 'simplify' not in args.skip, 'cse' not in args.skip)
+    return ast, before, count_instructions(ast)
+
+def link(path : str):
+    print("Compiling LLVM to binary program.")
+    if build(f"{path}.ll", path, cc=args.cc):
+        print("Unchanged since the last build, so reused it.")
+    print("Compile complete!")
+
+if args.batch != None:
+    if args.output == None:
+        arg_parser.error("--batch needs --output")
+    with open(args.batch) as f:
+        lines = [line.strip() for line in f]
+
+    nodes = []
+    before = 0
+    after = 0
+    for line_no, line in enumerate(lines, 1):
+        if line == "":
+            continue
+        try:
+            ast, line_before, line_after = prepare(line)
+        except ValueError as e:
+            print(f"Line {line_no}: {e}")
+            sys.exit(1)
+        nodes.append(ast)
+        before += line_before
+        after += line_after
+
+    if not args.no_optimise:
+        print(f"Optimised from {before} instructions to {after}.")
+    compile_batch(nodes, args.output + ".ll")
+    try:
+        link(args.output)
+    except subprocess.CalledProcessError as e:
+        print(f"{e.cmd[0]} failed, so the program wasn't built.")
+        sys.exit(1)
+    sys.exit(0)
 
 try:
     print("Welcome to Del's infix compiler. Please enter an expression you want to compile.")
@@ -10,18 +68,17 @@ try:
     print("Now enter the file you want to output to.")
     path = input()
 
-    tokens = luthor.lex(input_str)
-    ast = parser.parse(tokens)
+    ast, before, after = prepare(input_str)
+    if not args.no_optimise:
+        print(f"Optimised from {before} instructions to {after}.")
     compile(ast, path + ".ll")
-    
-    print("Compiling LLVM to binary program.")
-    subprocess.run(["llc","-filetype=obj",f"{path}.ll", "-o", f"{path}.o"])
-    subprocess.run(["clang",f"{path}.o","-no-pie",'-o',path])
-    print("Compile complete!")
+    link(path)
 
 # llc -filetype=obj math.ll -o math.o
 # clang math.o -no-pie -o math
 # ./math || echo $?
 
 except ValueError:
-    print("Oops, that wasn't a valid input. Try again.")
\ No newline at end of file
+    print("Oops, that wasn't a valid input. Try again.")
+except subprocess.CalledProcessError as e:
+    print(f"{e.cmd[0]} failed, so the program wasn't built.")
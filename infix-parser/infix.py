@@ -4,6 +4,12 @@ from copy import deepcopy
 from typing import Callable, Union
 from json import dumps
 from io import TextIOWrapper
+from array import array
+import builtins
+import math
+import operator
+import re
+import struct
 
 digits = [chr(i) for i in range(48,58)] # digits by char code
 whitespace = [' ', '\n', '\r', '\t'] # ignore
@@ -179,6 +185,124 @@ class InfixLexer:
 
         return self.tokens
 
+# the same tokens as InfixLexer, but read through a cursor instead of
+# re-slicing the tape for every character, so lexing is linear in the input.
+# also records the source offset of every token in self.offsets
+class InfixCursorLexer(InfixLexer):
+    NEUTRAL = 0
+    NUMBER = 1
+    MINUS = 2
+    EXPECT_OPERATOR = 3
+
+    digit_run = re.compile(r'[0-9]+')
+
+    def reset(self):
+        super().reset()
+        self.offsets = []
+
+    def push(self, token : str, offset : int):
+        self.tokens.append(token)
+        self.offsets.append(offset)
+        self.prev_token = token
+
+    def lex(self, input : str):
+        self.reset()
+        length = len(input)
+        pos = 0
+        state = self.NEUTRAL
+        # where the number being lexed, or the run of minuses, started
+        token_start = 0
+
+        while pos < length:
+            next_char = input[pos]
+            pos += 1
+
+            if state == self.NEUTRAL:
+                if next_char in digits or next_char == dot:
+                    self.cur_token = next_char
+                    token_start = pos - 1
+                    state = self.NUMBER
+                elif next_char == open_bracket:
+                    self.push(next_char, pos - 1)
+                    self.brackets_open += 1
+                elif next_char == minus:
+                    token_start = pos - 1
+                    state = self.MINUS
+                elif next_char not in whitespace:
+                    raise ValueError
+
+            elif state == self.NUMBER:
+                if next_char in digits:
+                    run = self.digit_run.match(input, pos - 1)
+                    self.cur_token += run.group()
+                    pos = run.end()
+                elif next_char == dot and not self.has_dot:
+                    self.has_dot = True
+                    self.cur_token += next_char
+                elif next_char in operators:
+                    self.has_dot = False
+                    self.push(self.cur_token, token_start)
+                    self.cur_token = ""
+                    if next_char == minus:
+                        token_start = pos - 1
+                        state = self.MINUS
+                        continue
+                    self.push(next_char, pos - 1)
+                    state = self.NEUTRAL
+                    if next_char == close_bracket:
+                        self.brackets_open -= 1
+                        state = self.EXPECT_OPERATOR
+                elif next_char not in whitespace:
+                    raise ValueError
+
+            elif state == self.MINUS:
+                # the first minus has already been read: collapse the rest of the run
+                minuses = 1
+                while (next_char == minus or next_char in whitespace) and pos < length:
+                    if next_char == minus:
+                        minuses += 1
+                    next_char = input[pos]
+                    pos += 1
+
+                if self.prev_token not in {None, open_bracket}.union(adme):
+                    self.push('+', token_start)
+                if not (minuses % 2) == 0:
+                    self.push('-', token_start)
+
+                if next_char in digits or next_char == dot:
+                    self.cur_token = next_char
+                    token_start = pos - 1
+                    state = self.NUMBER
+                elif next_char == open_bracket:
+                    self.push(next_char, pos - 1)
+                    self.brackets_open += 1
+                    state = self.NEUTRAL
+                else:
+                    raise ValueError()
+
+            else:
+                if next_char in operators:
+                    if next_char == close_bracket:
+                        self.brackets_open -= 1
+                    elif next_char == minus:
+                        token_start = pos - 1
+                        state = self.MINUS
+                        continue
+                    self.push(next_char, pos - 1)
+                    if not next_char == close_bracket:
+                        state = self.NEUTRAL
+                elif next_char not in whitespace:
+                    raise ValueError
+
+        # InfixLexer pushes a number still being lexed when the tape runs out
+        if self.cur_token != "":
+            self.push(self.cur_token, token_start)
+
+        if self.brackets_open != 0:
+            raise ValueError("Mismatched brackets in expression.")
+
+        return self.tokens
+
 @dataclass
 class ParseNode():
     token : str
@@ -277,6 +401,188 @@ class InfixParser():
 
         return cur_list[0]
 
+# builds the same trees as InfixParser in a single pass over token indices,
+# by precedence climbing. InfixParser reduces one operator level at a time,
+# left to right, so each level here binds tighter than the last and is left
+# associative. unary minus binds to the number or bracket that follows it
+class InfixClimbingParser():
+    precedence = {
+        '+': 1,
+        '/': 2,
+        '*': 3,
+        '^': 4
+    }
+
+    def __init__(self):
+        self.tokens = []
+        self.pos = 0
+
+    def parse(self, tokens : list[str]) -> ParseNode:
+        if len(tokens) == 0:
+            return None
+
+        self.tokens = tokens
+        self.pos = 0
+        node = self.parse_operators(1)
+
+        if self.pos != len(tokens):
+            raise ValueError(f"Unexpected {tokens[self.pos]} in expression.")
+        return node
+
+    def parse_operators(self, min_precedence : int) -> Union[str, ParseNode]:
+        left = self.parse_operand()
+        while self.pos < len(self.tokens):
+            operator = self.tokens[self.pos]
+            precedence = self.precedence.get(operator)
+            if precedence == None or precedence < min_precedence:
+                break
+            self.pos += 1
+            right = self.parse_operators(precedence + 1)
+            left = ParseNode(operator, [left, right])
+        return left
+
+    def parse_operand(self) -> Union[str, ParseNode]:
+        if self.pos >= len(self.tokens):
+            raise ValueError("Expression ended where a number was expected.")
+
+        token = self.tokens[self.pos]
+        self.pos += 1
+
+        if token == minus:
+            return ParseNode(minus, [self.parse_operand()])
+        elif token == open_bracket:
+            node = self.parse_operators(1)
+            if self.pos >= len(self.tokens) or self.tokens[self.pos] != close_bracket:
+                raise ValueError("Mismatched brackets in expression.")
+            self.pos += 1
+            return node
+        elif token in operators:
+            raise ValueError(f"Unexpected {token} in expression.")
+        return token
+
+class FlatOp(IntEnum):
+    CONST = 0
+    NEGATE = 1
+    ADD = 2
+    DIVIDE = 3
+    MULTIPLY = 4
+    POWER = 5
+
+flat_ops = {
+    '+': FlatOp.ADD,
+    '/': FlatOp.DIVIDE,
+    '*': FlatOp.MULTIPLY,
+    '^': FlatOp.POWER
+}
+flat_tokens = {op : token for token, op in flat_ops.items()}
+flat_tokens[FlatOp.NEGATE] = minus
+
+# a ParseNode tree flattened into parallel arrays in postfix order, so it can
+# be walked with one loop and a stack instead of recursion.
+# for CONST, args holds an index into consts. for operators it holds the
+# index of the left (or only) operand: the right operand always ends just
+# before the operator itself. the empty tree, None, has no ops at all
+class FlatAST():
+    def __init__(self):
+        self.ops = array('B')
+        self.args = array('I')
+        self.consts = array('d')
+        # the text each constant was written as, so to_tree gives back '5' and not '5.0'
+        self.texts : list[str] = []
+
+    @classmethod
+    def from_tree(cls, root) -> "FlatAST":
+        flat = cls()
+        if root == None:
+            return flat
+        const_ids = {}
+        # where each finished subtree's root ended up
+        positions = []
+        stack = [(root, False)]
+        while len(stack) > 0:
+            node, visited = stack.pop()
+            if isinstance(node, str):
+                if node not in const_ids:
+                    const_ids[node] = len(flat.consts)
+                    flat.consts.append(float(node))
+                    flat.texts.append(node)
+                flat.ops.append(FlatOp.CONST)
+                flat.args.append(const_ids[node])
+                positions.append(len(flat.ops) - 1)
+            elif not visited:
+                stack.append((node, True))
+                for child in reversed(node.children):
+                    stack.append((child, False))
+            elif node.token == minus:
+                positions.pop()
+                flat.ops.append(FlatOp.NEGATE)
+                flat.args.append(len(flat.ops) - 2)
+                positions.append(len(flat.ops) - 1)
+            else:
+                positions.pop()
+                left = positions.pop()
+                flat.ops.append(flat_ops[node.token])
+                flat.args.append(left)
+                positions.append(len(flat.ops) - 1)
+        return flat
+
+    def to_tree(self) -> Union[str, ParseNode]:
+        if len(self.ops) == 0:
+            return None
+        stack = []
+        for op, arg in zip(self.ops, self.args):
+            if op == FlatOp.CONST:
+                stack.append(self.texts[arg])
+            elif op == FlatOp.NEGATE:
+                stack[-1] = ParseNode(minus, [stack[-1]])
+            else:
+                right = stack.pop()
+                stack[-1] = ParseNode(flat_tokens[op], [stack[-1], right])
+        return stack[0]
+
+    def evaluate(self) -> float:
+        if len(self.ops) == 0:
+            return None
+        consts = self.consts
+        stack = []
+        for op, arg in zip(self.ops, self.args):
+            if op == FlatOp.CONST:
+                stack.append(consts[arg])
+            elif op == FlatOp.NEGATE:
+                stack[-1] = stack[-1] * -1
+            else:
+                right = stack.pop()
+                if op == FlatOp.ADD:
+                    stack[-1] = stack[-1] + right
+                elif op == FlatOp.MULTIPLY:
+                    stack[-1] = stack[-1] * right
+                elif op == FlatOp.DIVIDE:
+                    stack[-1] = stack[-1] / right
+                else:
+                    stack[-1] = stack[-1] ** right
+        return stack[0]
+
+    def compile_at(self, handle : TextIOWrapper, prev_node = -1):
+        # emits the same instructions, in the same order, as compile_at does
+        # for the tree: operands are floats for constants or ints for registers
+        stack = []
+        register = prev_node
+        for op, arg in zip(self.ops, self.args):
+            if op == FlatOp.CONST:
+                stack.append(self.consts[arg])
+                continue
+            register += 1
+            if op == FlatOp.NEGATE:
+                handle.write( op_to_llvm(minus, (stack[-1],), register) )
+            else:
+                right = stack.pop()
+                handle.write( op_to_llvm(flat_tokens[op], (stack[-1], right), register) )
+            stack[-1] = register
+        return stack[0]
+
+    def __len__(self) -> int:
+        return len(self.ops)
+
 def evaluate(node):
     ops = {
         '^' : lambda x, y : x ** y,
@@ -286,6 +592,8 @@ def evaluate(node):
     }
     if isinstance(node, str):
         return float(node)
+    elif isinstance(node, FlatAST):
+        return node.evaluate()
     elif isinstance(node, ParseNode):
         if node.token in adme:
             left = evaluate(node.children[0])
@@ -294,12 +602,161 @@ def evaluate(node):
         elif node.token == minus:
             return evaluate(node.children[0]) * -1
 
-
+# turns a tree into a python function which returns its value, so repeated
+# evaluation skips the tree walk. the function body is straight-line code with
+# one temporary per operator, which keeps deep trees clear of the parser's
+# nesting limits. the empty tree gives a function returning None.
+# functions are cached by their source, so only python's compile is skipped:
+# the tree is flattened and the source written on every call
+def compile_to_callable(node) -> Callable[[], float]:
+    if not isinstance(node, FlatAST):
+        node = FlatAST.from_tree(node)
+    return callable_from_source(callable_source(node))
+
+def callable_source(flat : FlatAST) -> str:
+    python_ops = {
+        FlatOp.ADD: '+',
+        FlatOp.DIVIDE: '/',
+        FlatOp.MULTIPLY: '*',
+        FlatOp.POWER: '**'
+    }
+    lines = ["def expression():"]
+    if len(flat) == 0:
+        lines.append("    return None")
+        return "\n".join(lines)
+    stack = []
+    for op, arg in zip(flat.ops, flat.args):
+        if op == FlatOp.CONST:
+            # repr gives inf and nan for numbers too large for a float, which
+            # callable_from_source defines as names
+            stack.append(repr(flat.consts[arg]))
+            continue
+        name = f"t{len(lines) - 1}"
+        if op == FlatOp.NEGATE:
+            # evaluate negates by multiplying, so keep that for -0.0 and nan
+            lines.append(f"    {name} = {stack[-1]} * -1")
+        else:
+            right = stack.pop()
+            lines.append(f"    {name} = {stack[-1]} {python_ops[op]} {right}")
+        stack[-1] = name
+    lines.append(f"    return {stack[0]}")
+    return "\n".join(lines)
+
+compiled_callables : dict[str, Callable[[], float]] = {}
+max_compiled_callables = 1024
+
+def callable_from_source(source : str) -> Callable[[], float]:
+    fn = compiled_callables.get(source)
+    if fn != None:
+        return fn
+
+    namespace = {'inf': float('inf'), 'nan': float('nan')}
+    # this module's compile writes LLVM, so ask for python's by name
+    exec(builtins.compile(source, "<infix expression>", "exec"), namespace)
+    fn = namespace['expression']
+
+    if len(compiled_callables) >= max_compiled_callables:
+        # drop the oldest entry
+        del compiled_callables[next(iter(compiled_callables))]
+    compiled_callables[source] = fn
+    return fn
+
+# the compiled program works in single precision, so folding rounds every
+# constant and result to a float32 to get the same answer llc's code would.
+# for + * / the double result rounded to float32 is exactly the float32 result
+def to_float32(value : float) -> float:
+    try:
+        return struct.unpack('f', struct.pack('f', value))[0]
+    except OverflowError:
+        return math.copysign(math.inf, value)
+
+fold_ops = {
+    '+': operator.add,
+    '/': operator.truediv,
+    '*': operator.mul
+}
+
+def is_const(node, value : float = None) -> bool:
+    return isinstance(node, str) and (value == None or float(node) == value)
+
+def fold_node(node : ParseNode) -> Union[str, ParseNode]:
+    if not all(isinstance(child, str) for child in node.children):
+        return node
+    values = [to_float32(float(child)) for child in node.children]
+    if node.token == minus:
+        return repr(-values[0])
+    # ^ can't be emitted and float32 pow isn't exactly rounded, so it's left
+    # alone. llc's code gives inf or nan for x/0, which python raises on
+    if node.token not in fold_ops or (node.token == '/' and values[1] == 0):
+        return node
+    return repr(to_float32(fold_ops[node.token](values[0], values[1])))
+
+def simplify_node(node : ParseNode) -> Union[str, ParseNode]:
+    left = node.children[0]
+    if node.token == minus:
+        if isinstance(left, ParseNode) and left.token == minus:
+            return left.children[0]
+        return node
+    right = node.children[1]
+    if node.token == '*' and is_const(right, 1.0):
+        return left
+    if node.token == '*' and is_const(left, 1.0):
+        return right
+    if node.token == '/' and is_const(right, 1.0):
+        return left
+    return node
+
+# structural hash of a node whose children have already been shared:
+# children are compared by identity, and + and * don't care about order.
+# constants go by repr, since 0.0 == -0.0 but 1/0.0 != 1/-0.0
+def node_key(node : ParseNode) -> tuple:
+    children = [('const', repr(float(child))) if isinstance(child, str) else ('node', id(child)) for child in node.children]
+    if node.token in {'+', '*'}:
+        children.sort()
+    return (node.token, tuple(children))
+
+# rewrites a tree before it's compiled. with cse the result can be a dag,
+# where identical subtrees are one shared node; compile emits those once
+def optimise(node, fold : bool = True, simplify : bool = True, cse : bool = True) -> Union[str, ParseNode]:
+    shared = {}
+
+    def visit(node):
+        if isinstance(node, str):
+            return node
+        node = ParseNode(node.token, [visit(child) for child in node.children])
+        if fold:
+            node = fold_node(node)
+        if simplify and isinstance(node, ParseNode):
+            node = simplify_node(node)
+        if cse and isinstance(node, ParseNode):
+            node = shared.setdefault(node_key(node), node)
+        return node
+
+    return visit(node)
+
+# the number of instructions compile emits: one per distinct operator node
+def count_instructions(node) -> int:
+    if isinstance(node, FlatAST):
+        return sum(1 for op in node.ops if op != FlatOp.CONST)
+    seen = set()
+    stack = [node]
+    while len(stack) > 0:
+        node = stack.pop()
+        if isinstance(node, str) or id(node) in seen:
+            continue
+        seen.add(id(node))
+        stack.extend(node.children)
+    return len(seen)
+
+def llvm_float(value : float) -> str:
+    # llvm only takes decimal float constants which are exact in single
+    # precision, so write the float32 value as the hex of its double
+    return "0x" + struct.pack('>d', to_float32(value)).hex().upper()
 
 def op_to_llvm(op, children : tuple[Union[int, float]], new_register : int):
     
     # determine if left is number or register
-    left_arg = f"{children[0]}"
+    left_arg = llvm_float(children[0]) if isinstance(children[0], float) else f"{children[0]}"
     if isinstance(children[0], int):
         left_arg = "%" + left_arg
 
@@ -307,7 +764,7 @@ def op_to_llvm(op, children : tuple[Union[int, float]], new_register : int):
     if op == minus:
         right_arg = "-1.0"
     else:
-        right_arg = f"{children[1]}"
+        right_arg = llvm_float(children[1]) if isinstance(children[1], float) else f"{children[1]}"
         if isinstance(children[1], int):
             right_arg = "%" + right_arg
 
@@ -323,6 +780,8 @@ def op_to_llvm(op, children : tuple[Union[int, float]], new_register : int):
 def compile_at(node, handle : TextIOWrapper, prev_node = -1):
     if isinstance(node, str):
         return float(node)
+    elif isinstance(node, FlatAST):
+        return node.compile_at(handle, prev_node)
     elif isinstance(node, ParseNode):
         if node.token in adme:
             left = compile_at(node.children[0], handle, prev_node=prev_node)
@@ -345,6 +804,27 @@ def compile_at(node, handle : TextIOWrapper, prev_node = -1):
             handle.write( op_to_llvm(node.token, (left, right), register + 1) )
             return register + 1
 
+# like compile_at, but also takes the dags optimise makes: a shared node is
+# emitted once and its register reused, so registers are numbered by a
+# counter rather than from the children's registers
+def compile_shared(node, handle : TextIOWrapper, prev_node = -1):
+    registers = {}
+    last = prev_node
+
+    def emit(node):
+        nonlocal last
+        if isinstance(node, str):
+            return float(node)
+        if id(node) in registers:
+            return registers[id(node)]
+        operands = tuple(emit(child) for child in node.children)
+        last += 1
+        handle.write( op_to_llvm(node.token, operands, last) )
+        registers[id(node)] = last
+        return last
+
+    return emit(node)
+
 def compile(node, path):
     prefix = '\n'.join([
         "@.str = private unnamed_addr constant [3 x i8] c\"%f\\00\", align 1",
@@ -355,12 +835,52 @@ def compile(node, path):
     ])
     with open(path, "w") as f:
         f.write(prefix)
-        last_node = compile_at(node, f)
+        if isinstance(node, ParseNode):
+            last_node = compile_shared(node, f)
+        else:
+            last_node = compile_at(node, f)
+
+        # a folded expression is just a constant
+        if isinstance(last_node, float):
+            result, out_register = llvm_float(last_node), 0
+        else:
+            result, out_register = f"%{last_node}", last_node + 1
 
         suffix = '\n'.join([
-            f"%{last_node+1} = fpext float %{last_node} to double",
-            f"%out = call i32 (i8*, ...) @printf(i8* getelementptr inbounds ([3 x i8], [3 x i8]* @.str, i64 0, i64 0), double %{last_node+1})",
+            f"%{out_register} = fpext float {result} to double",
+            f"%out = call i32 (i8*, ...) @printf(i8* getelementptr inbounds ([3 x i8], [3 x i8]* @.str, i64 0, i64 0), double %{out_register})",
             "ret i32 0",
             "}"
         ])
         f.write(suffix)
+
+
+# many expressions in one module, so one llc and one link cover them all.
+# each expression is its own function returning a float, and main prints
+# their results one per line, in order
+def compile_batch(nodes : list, path):
+    prefix = '\n'.join([
+        "@.line = private unnamed_addr constant [4 x i8] c\"%f\\0A\\00\", align 1",
+        "declare i32 @printf(i8*, ...)",
+        ""
+    ])
+    with open(path, "w") as f:
+        f.write(prefix)
+        for i, node in enumerate(nodes):
+            f.write(f"define float @expr{i}() {{\nentry:\n")
+            if isinstance(node, ParseNode):
+                last_node = compile_shared(node, f)
+            else:
+                last_node = compile_at(node, f)
+            result = llvm_float(last_node) if isinstance(last_node, float) else f"%{last_node}"
+            f.write(f"ret float {result}\n}}\n")
+
+        f.write("define i32 @main() {\nentry:\n")
+        for i in range(len(nodes)):
+            f.write('\n'.join([
+                f"%v{i} = call float @expr{i}()",
+                f"%d{i} = fpext float %v{i} to double",
+                f"%out{i} = call i32 (i8*, ...) @printf(i8* getelementptr inbounds ([4 x i8], [4 x i8]* @.line, i64 0, i64 0), double %d{i})",
+                ""
+            ]))
+        f.write("ret i32 0\n}\n")
@@ -0,0 +1,112 @@
+# drives server.py with random expressions over several pipelined
+# connections, and reports throughput and latency. with --local it starts
+# the server itself on a free port, so it needs nothing else running
+# python loadgen.py --local -c 8 -n 10000 --check
+
+from argparse import ArgumentParser
+from collections import deque
+from random import Random
+from time import perf_counter
+import asyncio
+import os
+import sys
+
+from bench_infix import make_expression
+from bulk import make_cache, evaluate_line
+from server import EvaluationServer, percentiles, format_stats
+
+def make_requests(count : int, invalid : float, seed : int) -> list[str]:
+    rng = Random(seed)
+    requests = []
+    for _ in range(count):
+        expression = make_expression(rng, rng.randint(1, 8), max_depth=rng.randint(0, 3))
+        if rng.random() < invalid:
+            expression += rng.choice(["+", "*", ")", "("])
+        requests.append(expression)
+    return requests
+
+async def run_connection(host : str, port : int, requests : list[str], depth : int, latencies : list[float]) -> list[str]:
+    reader, writer = await asyncio.open_connection(host, port)
+    # at most depth requests are waiting for an answer at once. answers come
+    # back in order, so the oldest send time belongs to the next answer
+    window = asyncio.Semaphore(depth)
+    sent = deque()
+
+    async def send():
+        for request in requests:
+            await window.acquire()
+            sent.append(perf_counter())
+            writer.write(f"{request}\n".encode("utf-8"))
+            await writer.drain()
+        writer.write_eof()
+
+    sending = asyncio.create_task(send())
+    answers = []
+    for _ in requests:
+        line = await reader.readline()
+        if line == b"":
+            raise ConnectionError(f"Server closed the connection after {len(answers)} answers")
+        latencies.append(perf_counter() - sent.popleft())
+        window.release()
+        answers.append(line.decode("utf-8").rstrip("\n"))
+    await sending
+    writer.close()
+    await writer.wait_closed()
+    return answers
+
+def expected_answer(cache, request : str) -> str:
+    ok, text = evaluate_line(cache, request)
+    return f"{'ok' if ok else 'error'} {text}"
+
+async def run_load(args) -> int:
+    server = None
+    port = args.port
+    if args.local:
+        server = EvaluationServer(args.workers)
+        listening = await server.start(args.host, 0)
+        port = listening.sockets[0].getsockname()[1]
+
+    try:
+        per_connection = [make_requests(args.requests, args.invalid, args.seed + i) for i in range(args.connections)]
+        latencies = []
+        start = perf_counter()
+        answers = await asyncio.gather(*(run_connection(args.host, port, requests, args.depth, latencies) for requests in per_connection))
+        elapsed = perf_counter() - start
+    finally:
+        if server != None:
+            server_stats = server.stats()
+            await server.close()
+
+    total = args.connections * args.requests
+    errors = sum(1 for lines in answers for line in lines if line.startswith("error"))
+    print(f"{total} requests over {args.connections} connections in {elapsed:.3f}s, {total / elapsed:.0f} requests/s, {errors} errors")
+    print("client " + format_stats(percentiles(latencies)))
+    if server != None:
+        print("server " + format_stats(server_stats))
+
+    if args.check:
+        cache = make_cache('cursor', 'climbing', 1024)
+        for requests, lines in zip(per_connection, answers):
+            for request, line in zip(requests, lines):
+                if line != expected_answer(cache, request):
+                    print(f"Wrong answer for {request}: {line}", file=sys.stderr)
+                    return 1
+        print(f"All {total} answers match evaluating in order")
+    return 0
+
+if __name__ == "__main__":
+    arg_parser = ArgumentParser(prog="Calculator Load Generator")
+    arg_parser.add_argument('--host', default="127.0.0.1")
+    arg_parser.add_argument('--port', type=int, default=7878)
+    arg_parser.add_argument('--local', action='store_true', help="start a server in this process instead of connecting to one")
+    arg_parser.add_argument('-w', '--workers', type=int, default=os.cpu_count(), help="workers for the --local server")
+    arg_parser.add_argument('-c', '--connections', type=int, default=4)
+    arg_parser.add_argument('-n', '--requests', type=int, default=10000, help="requests sent on each connection")
+    arg_parser.add_argument('-d', '--depth', type=int, default=128, help="requests a connection sends before waiting for answers")
+    arg_parser.add_argument('-x', '--invalid', type=float, default=0.01, help="fraction of requests which are invalid")
+    arg_parser.add_argument('--seed', type=int, default=0)
+    arg_parser.add_argument('--check', action='store_true', help="check every answer against evaluating here")
+
+    args = arg_parser.parse_args(sys.argv[1:])
+
+    sys.exit(asyncio.run(run_load(args)))
@@ -1,12 +1,29 @@
-from infix import InfixLexer, InfixParser, evaluate
+from infix import InfixLexer, InfixCursorLexer, InfixParser, InfixClimbingParser, evaluate
+from cache import ExpressionCache
+from argparse import ArgumentParser
+import sys
 
-luthor = InfixLexer()
-parser = InfixParser()
+arg_parser = ArgumentParser(prog="Super Simple Calculator")
+arg_parser.add_argument('-l', '--lexer', choices=['tape', 'cursor'], default='tape')
+arg_parser.add_argument('-p', '--parser', choices=['reduce', 'climbing'], default='reduce')
+arg_parser.add_argument('-e', '--cache-entries', type=int, default=1024, help="expressions to keep parsed, 0 turns the cache off")
+arg_parser.add_argument('-b', '--cache-bytes', type=int, default=1 << 22, help="approximate memory bound for the cache")
+args = arg_parser.parse_args(sys.argv[1:])
+
+luthor = InfixCursorLexer() if args.lexer == 'cursor' else InfixLexer()
+parser = InfixClimbingParser() if args.parser == 'climbing' else InfixParser()
+cache = ExpressionCache(luthor, parser, args.cache_entries, args.cache_bytes) if args.cache_entries > 0 else None
 
 print("Welcome to Super Simple Calculator!")
 while (True):
     input_str = input("> ")
+    if input_str.strip() == "stats":
+        print(cache.stats() if cache != None else "The cache is off.")
+        continue
     try:
+        if cache != None:
+            print(cache.evaluate(input_str))
+            continue
         tokens = luthor.lex(input_str)
         ast = parser.parse(tokens)
         print(evaluate(ast))
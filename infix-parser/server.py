@@ -0,0 +1,238 @@
+# an asyncio server for the calculator. clients send one expression per line
+# and get one line back per expression, in the same order: "ok <value>" or
+# "error <message>". a client can send as many lines as it likes without
+# waiting for answers. the line "stats" is answered with the latency
+# percentiles instead
+# python server.py --port 7878, then python loadgen.py --port 7878
+
+from argparse import ArgumentParser
+from collections import deque
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from time import perf_counter
+import asyncio
+import os
+import sys
+
+from bulk import init_worker, evaluate_chunk
+
+# keeps this many of the latest latencies for the percentiles
+LATENCY_SAMPLES = 100000
+# lines longer than this are refused and the connection closed
+MAX_LINE = 1 << 20
+
+def percentiles(samples : list[float], points : list[float] = [50, 90, 99]) -> dict[str, float]:
+    ordered = sorted(samples)
+    if len(ordered) == 0:
+        return {}
+    out = {f"p{point:g}" : ordered[min(len(ordered) - 1, int(len(ordered) * point / 100))] for point in points}
+    out['max'] = ordered[-1]
+    return out
+
+def format_stats(stats : dict) -> str:
+    parts = []
+    for key, value in stats.items():
+        if key.startswith("p") or key == "max":
+            parts.append(f"{key}={value * 1000:.3f}ms")
+        elif isinstance(value, float):
+            parts.append(f"{key}={value:.2f}")
+        else:
+            parts.append(f"{key}={value}")
+    return " ".join(parts)
+
+class EvaluationServer():
+    def __init__(self, workers : int = os.cpu_count(), batch_size : int = 256, max_in_flight : int = 4096, lexer : str = 'cursor', parser : str = 'climbing', cache_entries : int = 1024):
+        self.workers = max(1, workers)
+        self.batch_size = batch_size
+        # with workers > 1 each batch goes to a process. with one, to a single
+        # thread of this process, which then owns the one lexer and parser
+        initargs = (lexer, parser, cache_entries)
+        if self.workers > 1:
+            self.executor : Executor = ProcessPoolExecutor(self.workers, initializer=init_worker, initargs=initargs)
+        else:
+            self.executor = ThreadPoolExecutor(1, initializer=init_worker, initargs=initargs)
+        # requests read but not yet written back, across every connection.
+        # when it runs out connections stop reading, so TCP pushes back on
+        # clients, including ones which send without reading their answers
+        self.in_flight = asyncio.Semaphore(max_in_flight)
+        # a couple of batches per worker, so workers never wait on the loop
+        self.batch_slots = asyncio.Semaphore(self.workers * 2)
+        self.pending : asyncio.Queue = asyncio.Queue()
+        # set by close, after which new requests are refused
+        self.closing = False
+        # batches sent to the executor and not answered yet
+        self.batch_tasks : set[asyncio.Task] = set()
+        self.latencies : deque[float] = deque(maxlen=LATENCY_SAMPLES)
+        self.requests = 0
+        self.errors = 0
+        self.batches = 0
+        self.connections = 0
+        self.batcher : asyncio.Task = None
+        self.server : asyncio.AbstractServer = None
+
+    async def start(self, host : str, port : int) -> asyncio.AbstractServer:
+        self.batcher = asyncio.create_task(self.run_batches())
+        self.server = await asyncio.start_server(self.handle, host, port, limit=MAX_LINE)
+        return self.server
+
+    async def close(self):
+        self.closing = True
+        if self.server != None:
+            self.server.close()
+            await self.server.wait_closed()
+        if self.batcher != None:
+            self.batcher.cancel()
+            try:
+                await self.batcher
+            except asyncio.CancelledError:
+                pass
+        # batches already sent get their answers. requests which never made
+        # it into one are answered with an error, so no connection waits forever
+        await asyncio.gather(*self.batch_tasks)
+        while not self.pending.empty():
+            self.refuse([self.pending.get_nowait()])
+        self.executor.shutdown(cancel_futures=True)
+
+    def stats(self) -> dict:
+        out = {
+            'requests': self.requests,
+            'errors': self.errors,
+            'batches': self.batches,
+            'mean_batch': self.requests / self.batches if self.batches > 0 else 0.0,
+            'connections': self.connections
+        }
+        out.update(percentiles(list(self.latencies)))
+        return out
+
+    async def run_batches(self):
+        # whatever queued up while the last batches ran goes in the next one,
+        # so batches grow with load without waiting on a timer
+        while True:
+            batch = [await self.pending.get()]
+            while len(batch) < self.batch_size and not self.pending.empty():
+                batch.append(self.pending.get_nowait())
+            try:
+                await self.batch_slots.acquire()
+            except asyncio.CancelledError:
+                self.refuse(batch)
+                raise
+            task = asyncio.create_task(self.run_batch(batch))
+            self.batch_tasks.add(task)
+            task.add_done_callback(self.batch_tasks.discard)
+
+    def refuse(self, batch : list[tuple[str, asyncio.Future]]):
+        for _, future in batch:
+            if not future.done():
+                future.set_result((False, "Server is closing"))
+
+    async def run_batch(self, batch : list[tuple[str, asyncio.Future]]):
+        loop = asyncio.get_running_loop()
+        try:
+            results = await loop.run_in_executor(self.executor, evaluate_chunk, [line for line, _ in batch])
+        # evaluate_chunk answers each line's errors itself, so this is the
+        # executor failing, e.g. a worker process dying, and no line got an answer
+        except Exception as e:
+            results = [(False, f"{type(e).__name__}: {e}")] * len(batch)
+        finally:
+            self.batch_slots.release()
+        self.batches += 1
+        for (_, future), result in zip(batch, results):
+            if not future.done():
+                future.set_result(result)
+
+    async def handle(self, reader : asyncio.StreamReader, writer : asyncio.StreamWriter):
+        # the reader keeps taking requests while earlier ones are evaluated.
+        # responses waits on each in the order they came in
+        loop = asyncio.get_running_loop()
+        self.connections += 1
+        responses : asyncio.Queue = asyncio.Queue()
+        writing = asyncio.create_task(self.write_responses(responses, writer))
+        try:
+            while True:
+                try:
+                    line = await reader.readline()
+                except (ValueError, ConnectionError) as e:
+                    if isinstance(e, ValueError):
+                        future = loop.create_future()
+                        future.set_result((False, f"Lines are limited to {MAX_LINE} bytes"))
+                        responses.put_nowait((perf_counter(), future, False))
+                    break
+                if line == b"":
+                    break
+                received = perf_counter()
+                text = line.decode("utf-8", errors="replace").rstrip("\r\n")
+                future = loop.create_future()
+                counted = text.strip() != "stats"
+                if counted:
+                    await self.in_flight.acquire()
+                    self.requests += 1
+                    if self.closing:
+                        self.refuse([(text, future)])
+                    else:
+                        self.pending.put_nowait((text, future))
+                else:
+                    future.set_result((True, format_stats(self.stats())))
+                responses.put_nowait((received, future, counted))
+        finally:
+            responses.put_nowait(None)
+            await writing
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except ConnectionError:
+                pass
+
+    async def write_responses(self, responses : asyncio.Queue, writer : asyncio.StreamWriter):
+        connected = True
+        while True:
+            item = await responses.get()
+            if item == None:
+                return
+            received, future, counted = item
+            ok, text = await future
+            if not ok:
+                self.errors += 1
+            self.latencies.append(perf_counter() - received)
+            # a client which went away still has its requests counted, but
+            # nothing more is written to it
+            if connected:
+                try:
+                    writer.write(f"{'ok' if ok else 'error'} {text}\n".encode("utf-8"))
+                    await writer.drain()
+                except ConnectionError:
+                    connected = False
+            # only once the answer has left, so a client which doesn't read
+            # holds on to its requests' share of in_flight
+            if counted:
+                self.in_flight.release()
+
+async def serve(args):
+    server = EvaluationServer(args.workers, args.batch_size, args.max_in_flight, args.lexer, args.parser, args.cache_entries)
+    await server.start(args.host, args.port)
+    print(f"Listening on {args.host}:{args.port} with {server.workers} workers", file=sys.stderr)
+    try:
+        while True:
+            await asyncio.sleep(args.stats_interval if args.stats_interval > 0 else 3600)
+            if args.stats_interval > 0:
+                print(format_stats(server.stats()), file=sys.stderr)
+    finally:
+        print(format_stats(server.stats()), file=sys.stderr)
+        await server.close()
+
+if __name__ == "__main__":
+    arg_parser = ArgumentParser(prog="Calculator Server")
+    arg_parser.add_argument('--host', default="127.0.0.1")
+    arg_parser.add_argument('--port', type=int, default=7878)
+    arg_parser.add_argument('-w', '--workers', type=int, default=os.cpu_count(), help="processes to evaluate on, 1 uses a thread of this one")
+    arg_parser.add_argument('-n', '--batch-size', type=int, default=256, help="most requests sent to a worker at once")
+    arg_parser.add_argument('-f', '--max-in-flight', type=int, default=4096, help="requests read but not answered before reading stops")
+    arg_parser.add_argument('-s', '--stats-interval', type=float, default=0, help="print stats every this many seconds")
+    arg_parser.add_argument('-l', '--lexer', choices=['tape', 'cursor'], default='cursor')
+    arg_parser.add_argument('-p', '--parser', choices=['reduce', 'climbing'], default='climbing')
+    arg_parser.add_argument('-e', '--cache-entries', type=int, default=1024, help="expressions each worker keeps parsed")
+
+    args = arg_parser.parse_args(sys.argv[1:])
+
+    try:
+        asyncio.run(serve(args))
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,95 @@
+# IPC = Infix Plus Compiler
+# compiles infix-plus programs to bytecode for the register VM in infix-vm.
+# variables are given their register when the program is compiled, so
+# running it never looks a name up
+
+from argparse import ArgumentParser
+import os
+import sys
+
+sys.path.insert(1,"../infix-vm")
+
+from ipl import InfixPlusLexer
+from ipp import InfixPlusParser, IPToken, IPNode
+from ipe import output_names
+from vm import Bytecode, BytecodeBuilder, Op, Register, VM, load_cached
+
+# bump whenever the code compile_program emits changes, so cached bytecode is rebuilt
+IPC_VERSION = 1
+CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "__vmcache__")
+
+vm_ops = {
+    IPToken.ADD: Op.ADD,
+    IPToken.SUBTRACT: Op.SUBTRACT,
+    IPToken.MULTIPLY: Op.MULTIPLY,
+    IPToken.DIVIDE: Op.DIVIDE
+}
+
+# returns the register holding the node's value. depth is the first
+# temporary the node may write to
+def compile_expr(builder : BytecodeBuilder, node : IPNode, depth : int) -> Register:
+    kind, children = node
+    if kind == IPToken.EXPR:
+        return compile_expr(builder, children, depth)
+    elif kind == IPToken.NUMBER:
+        return builder.const(float(children))
+    elif kind == IPToken.TOKEN:
+        return builder.var(children)
+    elif kind == IPToken.NEGATE:
+        value = compile_expr(builder, children[0], depth)
+        dst = builder.temp(depth)
+        builder.emit(Op.NEGATE, dst, value)
+        return dst
+    elif kind == IPToken.ASSIGNMENT:
+        value = compile_expr(builder, children[1], depth)
+        slot = builder.var(children[0][1], reading=False)
+        builder.emit(Op.MOVE, slot, value)
+        return slot
+    elif kind in vm_ops:
+        left = compile_expr(builder, children[0], depth)
+        right = compile_expr(builder, children[1], depth + 1)
+        dst = builder.temp(depth)
+        builder.emit(vm_ops[kind], dst, left, right)
+        return dst
+    raise ValueError(f"Can't compile {kind.name}.")
+
+def compile_program(ast : list[IPNode]) -> Bytecode:
+    builder = BytecodeBuilder()
+    for name, node in zip(output_names(ast), ast):
+        builder.output(compile_expr(builder, node, 0), name)
+    return builder.finish()
+
+def compile_source(text : str) -> Bytecode:
+    lexer = InfixPlusLexer()
+    parser = InfixPlusParser()
+    return compile_program(list(parser.parse_stream(lexer.lex(text))))
+
+def compile_cached(text : str, cache_dir : str = CACHE_DIR) -> Bytecode:
+    return load_cached(cache_dir, f"ipc\0{IPC_VERSION}\0{text}", lambda : compile_source(text))
+
+def run_program(bytecode : Bytecode, inputs : dict[str, float] = None) -> dict[str, float]:
+    return dict(zip(bytecode.output_names, VM(bytecode).run(inputs)))
+
+def parse_binding(arg : str) -> tuple[str, float]:
+    name, sep, value = arg.partition("=")
+    if sep == "" or name == "":
+        raise ValueError(f"Inputs are given as name=value, not {arg}")
+    return name, float(value)
+
+if __name__ == "__main__":
+    arg_parser = ArgumentParser(prog="Infix Plus Compiler")
+    arg_parser.add_argument('-i', '--input', required=True)
+    arg_parser.add_argument('-b', '--bind', action='append', default=[], help="give a free variable a value, as name=value")
+    arg_parser.add_argument('-n', '--no-cache', action='store_true', help="compile even if cached bytecode exists")
+    arg_parser.add_argument('-d', '--dump', action='store_true', help="print the bytecode")
+
+    args = arg_parser.parse_args(sys.argv[1:])
+
+    with open(args.input) as f:
+        text = f.read()
+
+    bytecode = compile_source(text) if args.no_cache else compile_cached(text)
+    if args.dump:
+        print(bytecode)
+    for name, value in run_program(bytecode, dict(map(parse_binding, args.bind))).items():
+        print(f"{name} = {value}")
@@ -0,0 +1,203 @@
+# a cache of lexed and parsed programs on disk, so running an unchanged
+# program again skips the lexer and parser. entries are keyed by the program
+# text, the lexer table and PARSER_VERSION, and each file has a header with
+# its length and checksum. anything which doesn't check out is rebuilt
+# python ipcache.py -i program.ip
+
+from argparse import ArgumentParser
+from array import array
+from hashlib import sha256
+from time import perf_counter
+from typing import Optional
+import marshal
+import os
+import struct
+import sys
+import zlib
+
+from ipl import InfixPlusLexer, IPLexToken, transitions
+from ipp import InfixPlusParser, IPToken, IPNode, PARSER_VERSION
+from codegen import describe_table
+
+CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "__ipcache__")
+# bump whenever the layout of an entry changes
+FORMAT_VERSION = 1
+MAGIC = b"IPK\0"
+# magic, format version, payload length, crc32 of the payload
+HEADER = struct.Struct("<4sHII")
+
+token_kinds = {kind.value : kind for kind in IPLexToken}
+node_kinds = [None] * (max(IPToken) + 1)
+for kind in IPToken:
+    node_kinds[kind] = kind
+
+def lexer_fingerprint(table : dict = transitions) -> str:
+    # the table with actions by position, plus each action's code, so editing
+    # either the table or what an action does makes a new key
+    description, actions = describe_table(table)
+    digest = sha256(repr(description).encode("utf-8"))
+    for fn in actions:
+        code = getattr(getattr(fn, "__func__", fn), "__code__", None)
+        digest.update(getattr(fn, "__qualname__", repr(fn)).encode("utf-8"))
+        if code != None:
+            digest.update(code.co_code)
+            digest.update(repr(code.co_consts).encode("utf-8"))
+    return digest.hexdigest()
+
+def cache_key(text : str, fingerprint : str) -> str:
+    content = sha256(text.encode("utf-8")).hexdigest()
+    return f"{content}\0{fingerprint}\0{PARSER_VERSION}"
+
+# trees are stored flat, in postfix order, since long chains of + make them
+# deeper than marshal or recursion allow. each node has its kind (marshal only
+# takes plain ints) and a shape: LEAF for NUMBER and TOKEN, whose text is
+# the next in leaf_texts, WRAPPED for EXPR holding one node, or the number
+# of children in the list
+LEAF, WRAPPED = 255, 254
+
+def encode_tree(ast : list[IPNode]) -> tuple[bytes, bytes, list[str]]:
+    kinds = array('B')
+    shapes = array('B')
+    leaf_texts = []
+    stack = [(node, False) for node in reversed(ast)]
+    while len(stack) > 0:
+        node, children_done = stack.pop()
+        kind, children = node
+        if isinstance(children, str):
+            kinds.append(kind)
+            shapes.append(LEAF)
+            leaf_texts.append(children)
+        elif children_done:
+            kinds.append(kind)
+            shapes.append(len(children) if isinstance(children, list) else WRAPPED)
+        else:
+            stack.append((node, True))
+            if isinstance(children, list):
+                if len(children) >= WRAPPED:
+                    raise ValueError(f"Can't cache a node with {len(children)} children.")
+                stack.extend((child, False) for child in reversed(children))
+            else:
+                stack.append((children, False))
+    return kinds.tobytes(), shapes.tobytes(), leaf_texts
+
+def decode_tree(kinds : bytes, shapes : bytes, leaf_texts : list[str]) -> list[IPNode]:
+    kind_of = node_kinds
+    stack = []
+    texts = iter(leaf_texts)
+    for kind, shape in zip(kinds, shapes):
+        if shape == LEAF:
+            stack.append((kind_of[kind], next(texts)))
+        elif shape == WRAPPED:
+            stack[-1] = (kind_of[kind], stack[-1])
+        else:
+            children = stack[len(stack) - shape:]
+            del stack[len(stack) - shape:]
+            stack.append((kind_of[kind], children))
+    return stack
+
+def encode_entry(key : str, kinds : bytes, texts : list[str], ast : list[IPNode]) -> bytes:
+    payload = marshal.dumps((key, kinds, texts) + encode_tree(ast))
+    return HEADER.pack(MAGIC, FORMAT_VERSION, len(payload), zlib.crc32(payload)) + payload
+
+def decode_entry(data : bytes, key : str) -> tuple[bytes, list[str], list[IPNode]]:
+    # (token kinds, token texts, tree), or ValueError if the entry is
+    # truncated, corrupt, from another format or for another key
+    if len(data) < HEADER.size:
+        raise ValueError("Cache entry is truncated.")
+    magic, version, length, checksum = HEADER.unpack_from(data)
+    if magic != MAGIC or version != FORMAT_VERSION:
+        raise ValueError("Cache entry is from another format.")
+    payload = data[HEADER.size:]
+    if len(payload) != length or zlib.crc32(payload) != checksum:
+        raise ValueError("Cache entry is corrupt.")
+    stored_key, kinds, texts, tree_kinds, shapes, leaf_texts = marshal.loads(payload)
+    if stored_key != key:
+        raise ValueError("Cache entry is for another program.")
+    return kinds, texts, decode_tree(tree_kinds, shapes, leaf_texts)
+
+class CachedProgram():
+    def __init__(self, kinds : bytes, texts : list[str], ast : list[IPNode], status : str):
+        self.kinds = kinds
+        self.texts = texts
+        self.ast = ast
+        # hit, miss, or rebuilt when a bad entry was replaced
+        self.status = status
+
+    # tokens are only decoded if they're asked for
+    def tokens(self) -> list[tuple[IPLexToken, str]]:
+        return [(token_kinds[kind], text) for kind, text in zip(self.kinds, self.texts)]
+
+class ProgramCache():
+    def __init__(self, cache_dir : str = CACHE_DIR):
+        self.cache_dir = cache_dir
+        self.fingerprint = lexer_fingerprint()
+        # only built on a miss, so a warm start never compiles the lexer
+        self.lexer : Optional[InfixPlusLexer] = None
+        self.parser = InfixPlusParser()
+
+    def path(self, key : str) -> str:
+        return os.path.join(self.cache_dir, f"{sha256(key.encode('utf-8')).hexdigest()[:32]}.ipk")
+
+    def load(self, text : str) -> CachedProgram:
+        key = cache_key(text, self.fingerprint)
+        path = self.path(key)
+        status = "miss"
+        try:
+            with open(path, "rb") as f:
+                kinds, texts, ast = decode_entry(f.read(), key)
+            return CachedProgram(kinds, texts, ast, "hit")
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError, EOFError, TypeError, IndexError, StopIteration):
+            status = "rebuilt"
+
+        if self.lexer == None:
+            self.lexer = InfixPlusLexer()
+        tokens = self.lexer.lex(text)
+        ast = list(self.parser.parse_stream(tokens))
+        kinds = array('B', [kind for kind, _ in tokens]).tobytes()
+        texts = [text for _, text in tokens]
+        data = encode_entry(key, kinds, texts, ast)
+        os.makedirs(self.cache_dir, exist_ok=True)
+        # write then rename so a concurrent run never reads half a file
+        temp_path = f"{path}.{os.getpid()}.tmp"
+        with open(temp_path, "wb") as f:
+            f.write(data)
+        os.replace(temp_path, path)
+        return CachedProgram(kinds, texts, ast, status)
+
+def parse_cached(text : str, cache_dir : str = CACHE_DIR) -> list[IPNode]:
+    return ProgramCache(cache_dir).load(text).ast
+
+if __name__ == "__main__":
+    arg_parser = ArgumentParser(prog="Infix Plus Cache")
+    arg_parser.add_argument('-i', '--input', required=True)
+    arg_parser.add_argument('-r', '--repeats', type=int, default=5)
+
+    args = arg_parser.parse_args(sys.argv[1:])
+
+    with open(args.input) as f:
+        text = f.read()
+
+    # times a cold lex and parse against warm loads from the cache
+    lexer = InfixPlusLexer()
+    parser = InfixPlusParser()
+    start = perf_counter()
+    expected = list(parser.parse_stream(lexer.lex(text)))
+    cold = perf_counter() - start
+
+    cache = ProgramCache()
+    program = cache.load(text)
+    print(f"First load: {program.status}")
+    best = None
+    for _ in range(args.repeats):
+        start = perf_counter()
+        program = cache.load(text)
+        elapsed = perf_counter() - start
+        if best == None or elapsed < best:
+            best = elapsed
+    # compared flat, since == recurses through deep trees
+    if encode_tree(program.ast) != encode_tree(expected):
+        print("Cached tree differs from parsing.", file=sys.stderr)
+        sys.exit(1)
+    print(f"Lex and parse {cold:.4f}s, cached load {best:.4f}s ({program.status}), {cold / best:.1f}x")
@@ -0,0 +1,230 @@
+# IPD = Infix Plus Dependencies
+# evaluates a program like a spreadsheet: every assignment is a cell, names
+# not assigned anywhere are inputs, and changing an input or a formula only
+# recomputes the cells that depend on it, in dependency order
+
+from argparse import ArgumentParser
+from collections import deque
+import sys
+
+from ipl import InfixPlusLexer
+from ipp import InfixPlusParser, IPToken, IPNode
+from ipe import evaluate_expr, output_names
+
+def references(node : IPNode) -> set[str]:
+    names = set()
+    stack = [node]
+    while len(stack) > 0:
+        kind, children = stack.pop()
+        if kind == IPToken.TOKEN:
+            names.add(children)
+        elif kind == IPToken.EXPR:
+            stack.append(children)
+        elif kind == IPToken.ASSIGNMENT:
+            stack.append(children[1])
+        elif kind not in {IPToken.NUMBER}:
+            stack.extend(children)
+    return names
+
+# name -> the expression computing it
+def make_cells(ast : list[IPNode]) -> dict[str, IPNode]:
+    cells = {}
+    for name, node in zip(output_names(ast), ast):
+        # a chain like a = b = 1 makes each name a cell, referring to the next
+        chain = []
+        value = node[1]
+        while value[0] == IPToken.ASSIGNMENT:
+            chain.append(value[1][0][1])
+            value = value[1][1][1]
+        if len(chain) == 0:
+            chain.append(name)
+        for i, target in enumerate(chain):
+            if target in cells:
+                raise ValueError(f"{target} is assigned more than once.")
+            cells[target] = (IPToken.TOKEN, chain[i+1]) if i+1 < len(chain) else value
+    return cells
+
+# names the cells read which have neither a formula nor a value
+def unbound_inputs(cells : dict[str, IPNode], inputs : dict) -> list[str]:
+    return sorted({name for expr in cells.values() for name in references(expr) if name not in cells and name not in inputs})
+
+class Sheet():
+    def __init__(self, ast : list[IPNode], inputs : dict = None):
+        self.cells = make_cells(ast)
+        self.inputs = {} if inputs == None else dict(inputs)
+        missing = unbound_inputs(self.cells, self.inputs)
+        if len(missing) > 0:
+            raise ValueError(f"{', '.join(missing)} {'is' if len(missing) == 1 else 'are'} not bound to a value.")
+        self.values : dict = dict(self.inputs)
+        self.recomputed = 0
+        self.total_recomputed = 0
+        self.build_graph()
+        self.recompute(set(self.cells))
+
+    def build_graph(self):
+        self.depends_on = {name : references(expr) for name, expr in self.cells.items()}
+        self.dependents : dict[str, set[str]] = {}
+        for name, names in self.depends_on.items():
+            for other in names:
+                self.dependents.setdefault(other, set()).add(name)
+        self.order = self.topological_order()
+        self.position = {name : i for i, name in enumerate(self.order)}
+
+    def topological_order(self) -> list[str]:
+        # Kahn's algorithm over the cells. inputs have no formula, so they're
+        # never waited on
+        waiting = {name : len([other for other in names if other in self.cells]) for name, names in self.depends_on.items()}
+        ready = deque(name for name in self.cells if waiting[name] == 0)
+        order = []
+        while len(ready) > 0:
+            name = ready.popleft()
+            order.append(name)
+            for dependent in self.dependents.get(name, ()):
+                waiting[dependent] -= 1
+                if waiting[dependent] == 0:
+                    ready.append(dependent)
+        if len(order) != len(self.cells):
+            raise ValueError(f"Cycle between {' -> '.join(self.find_cycle(set(self.cells) - set(order)))}")
+        return order
+
+    def find_cycle(self, stuck : set[str]) -> list[str]:
+        # every stuck cell depends on another stuck cell, so walking those
+        # edges has to come back round
+        name = min(stuck)
+        path = []
+        seen = {}
+        while name not in seen:
+            seen[name] = len(path)
+            path.append(name)
+            name = min(other for other in self.depends_on[name] if other in stuck)
+        return path[seen[name]:] + [name]
+
+    def dirty_from(self, names : set[str]) -> set[str]:
+        dirty = set()
+        pending = deque(names)
+        while len(pending) > 0:
+            name = pending.popleft()
+            for dependent in self.dependents.get(name, ()):
+                if dependent not in dirty:
+                    dirty.add(dependent)
+                    pending.append(dependent)
+        return dirty
+
+    def recompute(self, dirty : set[str]) -> int:
+        for name in sorted(dirty, key=self.position.__getitem__):
+            self.values[name] = evaluate_expr(self.cells[name], self.values)
+        self.recomputed = len(dirty)
+        self.total_recomputed += len(dirty)
+        return len(dirty)
+
+    # puts back the values names had, from saved (without an entry if they had none)
+    def restore_values(self, names : set[str], saved : dict):
+        for name in names:
+            if name in saved:
+                self.values[name] = saved[name]
+            else:
+                self.values.pop(name, None)
+
+    # changes some inputs and recomputes what depends on them. returns how
+    # many cells were recomputed. if a cell can't be evaluated the sheet is
+    # left as it was
+    def update(self, inputs : dict) -> int:
+        for name in inputs:
+            if name in self.cells:
+                raise ValueError(f"{name} has a formula, so it can't be set as an input.")
+        dirty = self.dirty_from(set(inputs))
+        touched = dirty | set(inputs)
+        saved = {name : self.values[name] for name in touched if name in self.values}
+        old_inputs = {name : self.inputs[name] for name in inputs if name in self.inputs}
+        self.inputs.update(inputs)
+        self.values.update(inputs)
+        try:
+            return self.recompute(dirty)
+        except Exception:
+            for name in inputs:
+                if name in old_inputs:
+                    self.inputs[name] = old_inputs[name]
+                else:
+                    del self.inputs[name]
+            self.restore_values(touched, saved)
+            raise
+
+    def set_input(self, name : str, value) -> int:
+        return self.update({name : value})
+
+    # gives a cell a new formula (or turns an input into a cell). if that
+    # makes a cycle, or a cell can't be evaluated, the sheet is left as it was
+    def set_formula(self, name : str, expr : IPNode) -> int:
+        old = self.cells.get(name)
+        was_input = name in self.inputs
+        old_input = self.inputs.get(name)
+        touched = set()
+        saved = {}
+        self.cells[name] = expr
+        try:
+            self.build_graph()
+            touched = {name} | self.dirty_from({name})
+            saved = {other : self.values[other] for other in touched if other in self.values}
+            self.inputs.pop(name, None)
+            return self.recompute(touched)
+        except Exception:
+            if old == None:
+                del self.cells[name]
+            else:
+                self.cells[name] = old
+            if was_input:
+                self.inputs[name] = old_input
+            self.build_graph()
+            self.restore_values(touched, saved)
+            raise
+
+if __name__ == "__main__":
+    arg_parser = ArgumentParser(prog="Infix Plus Sheet")
+    arg_parser.add_argument('-i', '--input', required=True)
+    arg_parser.add_argument('-b', '--bind', action='append', default=[], help="give an input a value, as name=value")
+
+    args = arg_parser.parse_args(sys.argv[1:])
+
+    lexer = InfixPlusLexer()
+    parser = InfixPlusParser()
+    with open(args.input) as f:
+        ast = list(parser.parse_stream(lexer.lex(f.read())))
+
+    inputs = {}
+    for binding in args.bind:
+        name, _, value = binding.partition("=")
+        inputs[name.strip()] = float(value)
+
+    try:
+        missing = unbound_inputs(make_cells(ast), inputs)
+        if len(missing) > 0:
+            arg_parser.error(f"{', '.join(missing)} {'has' if len(missing) == 1 else 'have'} no value, bind with {' '.join(f'-b {name}=...' for name in missing)}")
+        sheet = Sheet(ast, inputs)
+    except (ValueError, ArithmeticError) as e:
+        # a cycle, a name assigned twice, or a cell which can't be evaluated
+        arg_parser.error(str(e))
+    for name in sheet.order:
+        print(f"{name} = {sheet.values[name]}")
+
+    # then take edits: "x = 5" sets an input, "y = x * 2" sets a formula
+    print("Enter assignments to update the sheet.")
+    for line in sys.stdin:
+        try:
+            nodes = list(parser.parse_stream(lexer.lex(line)))
+            if len(nodes) == 0:
+                continue
+            expr = nodes[0][1]
+            if expr[0] != IPToken.ASSIGNMENT:
+                print(evaluate_expr(expr, sheet.values))
+                continue
+            name, value = expr[1][0][1], expr[1][1]
+            if name not in sheet.cells and value[1][0] == IPToken.NUMBER:
+                count = sheet.set_input(name, float(value[1][1]))
+            else:
+                count = sheet.set_formula(name, value)
+        except (ValueError, ArithmeticError) as e:
+            print(f"Error: {e}")
+            continue
+        print(f"Recomputed {count} cells.")
+        for name in sheet.order:
+            print(f"{name} = {sheet.values[name]}")
@@ -0,0 +1,149 @@
+# IPE = Infix Plus Evaluator
+# runs a parsed program, either on plain numbers or with the free identifiers
+# bound to numpy arrays, so each node is one whole-array operation
+
+from argparse import ArgumentParser
+from typing import Iterator, Optional
+import operator
+import os
+import sys
+
+from ipl import InfixPlusLexer
+from ipp import InfixPlusParser, IPToken, IPNode
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+operators = {
+    IPToken.ADD: operator.add,
+    IPToken.SUBTRACT: operator.sub,
+    IPToken.MULTIPLY: operator.mul,
+    IPToken.DIVIDE: operator.truediv
+}
+
+# the operators work the same on floats and arrays, so one walker does both
+def evaluate_expr(node : IPNode, env : dict):
+    kind, children = node
+    if kind == IPToken.EXPR:
+        return evaluate_expr(children, env)
+    elif kind == IPToken.NUMBER:
+        return float(children)
+    elif kind == IPToken.TOKEN:
+        if children not in env:
+            raise ValueError(f"{children} is not bound to a value.")
+        return env[children]
+    elif kind == IPToken.NEGATE:
+        return -evaluate_expr(children[0], env)
+    elif kind == IPToken.ASSIGNMENT:
+        value = evaluate_expr(children[1], env)
+        env[children[0][1]] = value
+        return value
+    elif kind in operators:
+        return operators[kind](evaluate_expr(children[0], env), evaluate_expr(children[1], env))
+    raise ValueError(f"Can't evaluate {kind.name}.")
+
+# each statement gives one output: assignments are named after their
+# target, other expressions after their position in the program
+def output_names(ast : list[IPNode]) -> list[str]:
+    names = []
+    for i, node in enumerate(ast):
+        expr = node[1]
+        if expr[0] == IPToken.ASSIGNMENT:
+            names.append(expr[1][0][1])
+        else:
+            names.append(f"_{i}")
+    return names
+
+def run_program(ast : list[IPNode], env : Optional[dict] = None) -> dict:
+    env = {} if env == None else env
+    results = {}
+    for name, node in zip(output_names(ast), ast):
+        results[name] = evaluate_expr(node, env)
+    return results
+
+def require_numpy():
+    if np == None:
+        raise ImportError("Vectorised evaluation needs numpy: pip install numpy")
+
+def column_length(columns : dict) -> int:
+    lengths = {len(column) for column in columns.values() if np.ndim(column) > 0}
+    if len(lengths) > 1:
+        raise ValueError(f"Columns have different lengths: {sorted(lengths)}")
+    return lengths.pop() if len(lengths) == 1 else 1
+
+def run_vectorised(ast : list[IPNode], columns : dict) -> dict:
+    require_numpy()
+    env = {name : np.asarray(column, dtype=np.float64) for name, column in columns.items()}
+    column_length(env)
+    return run_program(ast, env)
+
+# evaluates chunk_size rows at a time, so only one chunk of every column and
+# temporary needs to be in memory - columns can be memmaps bigger than RAM.
+# if outputs are given (e.g. memmaps from open_memmap) results are written there
+def run_chunked(ast : list[IPNode], columns : dict, chunk_size : int = 1 << 20, outputs : Optional[dict] = None) -> Iterator[tuple[int, int, dict]]:
+    require_numpy()
+    rows = column_length(columns)
+    for start in range(0, rows, chunk_size):
+        stop = min(start + chunk_size, rows)
+        env = {}
+        for name, column in columns.items():
+            if np.ndim(column) > 0:
+                env[name] = np.asarray(column[start:stop], dtype=np.float64)
+            else:
+                env[name] = float(column)
+        results = run_program(ast, env)
+        if outputs != None:
+            for name, out in outputs.items():
+                out[start:stop] = results[name]
+        yield start, stop, results
+
+def parse_column(arg : str) -> tuple[str, str]:
+    name, sep, path = arg.partition("=")
+    if sep == "" or name == "" or path == "":
+        raise ValueError(f"Columns are given as name=path.npy, not {arg}")
+    return name, path
+
+if __name__ == "__main__":
+    arg_parser = ArgumentParser(prog="Infix Plus Evaluator")
+    arg_parser.add_argument('-i', '--input', required=True)
+    arg_parser.add_argument('-c', '--column', action='append', default=[], help="bind an identifier to a .npy file, as name=path.npy")
+    arg_parser.add_argument('-n', '--chunk-size', type=int, default=1 << 20, help="rows evaluated at once")
+    arg_parser.add_argument('-o', '--output', help="directory to write one .npy file per statement to")
+
+    args = arg_parser.parse_args(sys.argv[1:])
+
+    with open(args.input) as f:
+        text = f.read()
+
+    lexer = InfixPlusLexer()
+    parser = InfixPlusParser()
+    ast = list(parser.parse_stream(lexer.lex(text)))
+
+    if len(args.column) == 0:
+        for name, value in run_program(ast).items():
+            print(f"{name} = {value}")
+        sys.exit(0)
+
+    require_numpy()
+    # memory mapped, so columns are paged in a chunk at a time
+    columns = {name : np.load(path, mmap_mode='r') for name, path in map(parse_column, args.column)}
+
+    outputs = None
+    if args.output != None:
+        os.makedirs(args.output, exist_ok=True)
+        rows = column_length(columns)
+        outputs = {
+            name : np.lib.format.open_memmap(os.path.join(args.output, f"{name}.npy"), mode='w+', dtype=np.float64, shape=(rows,))
+            for name in output_names(ast)
+        }
+
+    for start, stop, results in run_chunked(ast, columns, args.chunk_size, outputs):
+        if outputs == None:
+            for name, value in results.items():
+                print(f"{name}[{start}:{stop}] = {value}")
+
+    if outputs != None:
+        for out in outputs.values():
+            out.flush()
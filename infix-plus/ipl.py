@@ -2,11 +2,13 @@
 
 from enum import IntEnum, auto
 from argparse import ArgumentParser
+import re
 import sys
 
 sys.path.insert(1,"../abstract-lexer")
 
-from lexer import AbstractLexer, LexTransition, LexTransitionFn
+from lexer import AbstractLexer, LexTransition, LexTransitionFn, minimise
+from codegen import GeneratedLexer
 
 class IPLexToken(IntEnum):
     MINUS = auto()
@@ -125,6 +127,7 @@ transitions = {
             ],
             # always follows numbers, tokens and close brackets
             'expect-operator': [
+                (None, 'start', push_eof),
                 # perhaps check if brackets have been closed correctly - neutral might be wrong state to go to
                 (r'[\n\r]','start', push_operator),
                 (r'[ \t]','expect-operator', ()),
@@ -149,7 +152,7 @@ transitions = {
                 (r'(?![\n\r])','comment',())
             ],
             'token': [
-                (None, 'start', token_space),
+                (None, 'start', token_space + (push_eof,)),
                 (r'[\n\r]','start', token_tuple),
                 (r'[ \t]','expect-operator', token_space),
                 (r'\)', 'expect-operator', token_tuple),
@@ -166,16 +169,172 @@ class InfixPlusLexer(AbstractLexer):
     def __init__(self):
         super().__init__(transitions,"start")
 
-if __name__ == "__main__":
-    luthor = AbstractLexer(transitions, "start")
+# the same, but running code generated from the table (cached on disk)
+class GeneratedInfixPlusLexer(GeneratedLexer):
+    def __init__(self):
+        super().__init__(transitions,"start")
+
+# what the lexer carries from one line into the next: its state, the token
+# being built and the last token pushed (push_minus looks back at it)
+LineEntry = tuple[str, str, tuple[IPLexToken, str]]
+
+line_end = re.compile(r"(?<=[\n\r])")
+
+def split_lines(text : str) -> list[str]:
+    # lines keep their \n or \r, so "".join gives the text back. each \r and
+    # \n ends a line, as it does for the lexer
+    return line_end.split(text)
+
+# keeps the tokens of every line and the lexer's state at the start of each,
+# so an edit only re-lexes the lines it touched and then carries on until the
+# state going into a line is the same as before the edit. every newline
+# returns the table to start, so that's almost always the next line
+class IncrementalInfixPlusLexer():
+    def __init__(self, text : str = ""):
+        self.lexer = AbstractLexer(transitions, "start")
+        self.start_entry : LineEntry = ("start", "", None)
+        self.lines : list[str] = []
+        self.line_tokens : list[list[tuple[IPLexToken, str]]] = []
+        self.entries : list[LineEntry] = []
+        # line index -> message for lines the lexer rejected
+        self.errors : dict[int, str] = {}
+        self.replace_lines(0, 0, text)
+
+    def text(self) -> str:
+        return "".join(self.lines)
+
+    def lex_line(self, i : int, entry : LineEntry) -> LineEntry:
+        lexer = self.lexer
+        state, token, prev_token = entry
+        lexer.reset()
+        lexer.state = state
+        lexer.token = token
+        if prev_token != None:
+            lexer.tokens = [prev_token]
+            lexer.drained = 1
+
+        self.errors.pop(i, None)
+        try:
+            lexer.feed(self.lines[i])
+        except ValueError as e:
+            # the next line starts over, as it would after the newline
+            self.errors[i] = str(e)
+            self.line_tokens[i] = lexer.drain()
+            return ("start", "", (IPLexToken.NEW_LINE, "\n"))
+
+        self.line_tokens[i] = lexer.drain()
+        last = lexer.tokens[-1] if len(lexer.tokens) > 0 else prev_token
+        return (lexer.state, lexer.token, last)
 
+    # replaces lines[start:stop] with text and re-lexes what changed.
+    # returns how many lines were lexed
+    def replace_lines(self, start : int, stop : int, text : str) -> int:
+        if start < 0 or stop < start or stop > len(self.lines):
+            raise ValueError(f"Can't replace lines {start} to {stop} of {len(self.lines)}")
+        # only the last line has no newline, and anything after it joins it
+        if start > 0 and start == len(self.lines) and not self.lines[-1].endswith(("\n", "\r")):
+            start -= 1
+            text = self.lines[start] + text
+        # text without a newline at the end runs on into the line after it
+        if stop < len(self.lines) and not text.endswith(("\n", "\r")):
+            text += self.lines[stop]
+            stop += 1
+        new_lines = split_lines(text)
+        if stop < len(self.lines) and new_lines[-1] == "":
+            new_lines.pop()
+
+        # lines before start are untouched, so whatever state line start was
+        # entered with still holds
+        if start == 0:
+            entry = self.start_entry
+        elif start < len(self.lines):
+            entry = self.entries[start]
+        else:
+            entry = self.end_entry
+
+        self.lines[start:stop] = new_lines
+        self.line_tokens[start:stop] = [[] for _ in new_lines]
+        self.entries[start:stop] = [None for _ in new_lines]
+        # errors are keyed by line, so move the ones after the edit
+        shift = len(new_lines) - (stop - start)
+        self.errors = {
+            (i + shift if i >= stop else i) : message
+            for i, message in self.errors.items()
+            if i < start or i >= stop
+        }
+
+        i = start
+        lexed = 0
+        while i < len(self.lines):
+            if i >= start + len(new_lines) and self.entries[i] == entry:
+                break
+            self.entries[i] = entry
+            entry = self.lex_line(i, entry)
+            lexed += 1
+            i += 1
+        self.end_entry = entry if i == len(self.lines) else self.end_entry
+        return lexed
+
+    def tokens(self) -> list[tuple[IPLexToken, str]]:
+        # the same tokens lexing the whole text gives
+        if len(self.errors) > 0:
+            line = min(self.errors)
+            raise ValueError(f"Line {line + 1}: {self.errors[line]}")
+        out = [token for tokens in self.line_tokens for token in tokens]
+
+        lexer = self.lexer
+        state, token, prev_token = self.end_entry
+        lexer.reset()
+        lexer.state = state
+        lexer.token = token
+        lexer.tokens = [] if prev_token == None else [prev_token]
+        lexer.drained = len(lexer.tokens)
+        lexer.lex_eof()
+        out.extend(lexer.drain())
+        return out
+
+if __name__ == "__main__":
     parser = ArgumentParser(prog="Infix Plus Lexer")
     parser.add_argument('-i', '--input',action='store')
+    parser.add_argument('-s', '--stream',action='store_true')
+    parser.add_argument('-g', '--generated',action='store_true')
+    parser.add_argument('-p', '--profile',action='store_true')
+    parser.add_argument('-v', '--graphviz',action='store')
+    parser.add_argument('-a', '--analyse',action='store_true')
 
     args = parser.parse_args(sys.argv[1:])
+    # the generated lexer inlines the table, so it has nothing to count
+    if args.generated and args.profile:
+        parser.error("--profile needs the interpreted lexer, it can't be used with -g")
+
+    if args.generated:
+        luthor = GeneratedLexer(transitions, "start")
+    else:
+        luthor = AbstractLexer(transitions, "start", profile=args.profile)
 
-    if args.input:
+    if args.input and args.stream:
+        with open(args.input,'r') as f:
+            for token in luthor.lex_iter(f):
+                print(token)
+    elif args.input:
         with open(args.input,'r') as f:
             file = f.read()
         tokens = luthor.lex(file)
-        print(tokens)
\ No newline at end of file
+        print(tokens)
+
+    if args.profile:
+        for state, counts in luthor.stats().items():
+            print(f"{state:<20}{counts['visits']:>10} chars{counts['attempts']:>10} attempts{counts['seconds']:>10.4f}s{counts['eof']:>6} EOF{counts['eof_actions']:>6} EOF actions")
+            for transition in counts['transitions']:
+                print(f"    {transition['pattern']!r:<16}-> {transition['next_state']:<16}{transition['fired']:>10} fired{transition['attempts']:>10} attempts{transition['seconds']:>10.4f}s{transition['actions']:>8} actions")
+
+    if args.graphviz:
+        luthor.graphviz(args.graphviz)
+
+    if args.analyse:
+        # errors already stopped the lexer being built, so these are warnings
+        for key, found in luthor.report.items():
+            if len(found) > 0:
+                print(f"{key}: {found}")
+        merged = minimise(transitions, "start")[1]
+        print(f"{len(transitions) - len(merged)} of {len(transitions)} states left after merging equivalent ones {merged}")
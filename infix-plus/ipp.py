@@ -1,32 +1,70 @@
-from ipl import InfixPlusLexer, IPLexToken
+from ipl import InfixPlusLexer, GeneratedInfixPlusLexer, IPLexToken
+from tokenarray import TokenArray
+from parser import AbstractParser
 from enum import IntEnum, auto
 from argparse import ArgumentParser
+from typing import Iterable, Iterator, Optional, Union
 import sys
 
+# bump whenever the trees the parsers build change, so cached trees are rebuilt
+PARSER_VERSION = 1
+
 class IPToken(IntEnum):
     PROGRAM = auto()
     EXPR = auto()
     ASSIGNMENT = auto()
     ADD = auto()
+    SUBTRACT = auto()
+    MULTIPLY = auto()
+    DIVIDE = auto()
+    NEGATE = auto()
+    NUMBER = auto()
+    TOKEN = auto()
 
-IPNode = tuple[IPToken,list["IPNode"]]
+# leaves (NUMBER and TOKEN) hold their text instead of a list of children.
+# ASSIGNMENT holds [TOKEN, EXPR]; the operators hold their operands
+IPNode = tuple[IPToken,Union[list["IPNode"],"IPNode",str]]
 TokenList = list[tuple[IPLexToken, str]]
 
+binary_ops = {
+    IPLexToken.PLUS: IPToken.ADD,
+    IPLexToken.MINUS: IPToken.SUBTRACT,
+    IPLexToken.MULTIPLY: IPToken.MULTIPLY,
+    IPLexToken.DIVIDE: IPToken.DIVIDE
+}
+
 class InfixPlusParser():
 
     def parse_program(self, tokens : TokenList):
-        group_start = 0
-        children = []
-        for i, token in enumerate(tokens):
-            if token[0] in {IPLexToken.EOF, IPLexToken.NEW_LINE}:
-                expr_node = self.parse_expr(tokens[group_start:i])
-                if len(expr_node[1]) > 0:
-                    children.append(expr_node)
-                    # print(expr_node)
-                group_start = i+1
+        if isinstance(tokens, TokenArray):
+            children = list(self.parse_compact(tokens))
+        else:
+            children = list(self.parse_stream(tokens))
         print(children)
         return (IPToken.PROGRAM, children)
 
+    # parses one line at a time, so tokens can come straight from lex_iter
+    def parse_stream(self, tokens : Iterable[tuple[IPLexToken, str]]) -> Iterator[IPNode]:
+        group = []
+        for token in tokens:
+            if token[0] in {IPLexToken.EOF, IPLexToken.NEW_LINE}:
+                # blank and comment-only lines have no tokens
+                if len(group) > 0:
+                    yield self.parse_expr(group)
+                group = []
+            else:
+                group.append(token)
+
+    # reads the kinds array directly and hands each line on as a view, so no
+    # token tuples or lists are built for the grouping
+    def parse_compact(self, tokens : TokenArray) -> Iterator[IPNode]:
+        group_start = 0
+        for i, kind in enumerate(tokens.kinds):
+            if kind == IPLexToken.EOF or kind == IPLexToken.NEW_LINE:
+                if i > group_start:
+                    yield self.parse_expr(tokens[group_start:i])
+                group_start = i+1
+
     def parse_expr(self, tokens : TokenList):
         for fn in (self.parse_assignment, self.parse_add):
             try:
@@ -40,26 +78,387 @@ class InfixPlusParser():
         if len(tokens) > 2 and tokens[1][0] == IPLexToken.ASSIGN:
             if not tokens[0][0] == IPLexToken.TOKEN:
                 raise ValueError("Expression looks like an assignment but isn't.")
-            return (IPToken.ASSIGNMENT, self.parse_expr(tokens[2:]))
+            target = (IPToken.TOKEN, tokens[0][1])
+            return (IPToken.ASSIGNMENT, [target, self.parse_expr(tokens[2:])])
         raise ValueError("Not an assignment.")
 
+    # add, mul and term follow the PEG grammar, except that chains of + - and
+    # * / are built left to right so that 8 / 4 / 2 is (8 / 4) / 2
     def parse_add(self, tokens : TokenList):
-        return (IPToken.ADD, [])
+        node, end = self.parse_sum(tokens, 0)
+        if end != len(tokens):
+            raise ValueError(f"Unexpected {tokens[end][1]} in expression.")
+        return node
+
+    def parse_sum(self, tokens : TokenList, i : int) -> tuple[IPNode, int]:
+        left, i = self.parse_product(tokens, i)
+        while i < len(tokens) and tokens[i][0] in {IPLexToken.PLUS, IPLexToken.MINUS}:
+            right, next_i = self.parse_product(tokens, i+1)
+            left = (binary_ops[tokens[i][0]], [left, right])
+            i = next_i
+        return left, i
+
+    def parse_product(self, tokens : TokenList, i : int) -> tuple[IPNode, int]:
+        left, i = self.parse_term(tokens, i)
+        while i < len(tokens) and tokens[i][0] in {IPLexToken.MULTIPLY, IPLexToken.DIVIDE}:
+            right, next_i = self.parse_term(tokens, i+1)
+            left = (binary_ops[tokens[i][0]], [left, right])
+            i = next_i
+        return left, i
+
+    def parse_term(self, tokens : TokenList, i : int) -> tuple[IPNode, int]:
+        if i >= len(tokens):
+            raise ValueError("Expression ended where a term was expected.")
+
+        kind, text = tokens[i]
+        if kind == IPLexToken.NUMBER:
+            return (IPToken.NUMBER, text), i+1
+        elif kind == IPLexToken.TOKEN:
+            return (IPToken.TOKEN, text), i+1
+        elif kind == IPLexToken.NEGATE:
+            node, i = self.parse_term(tokens, i+1)
+            return (IPToken.NEGATE, [node]), i
+        elif kind == IPLexToken.OPEN_BRACKET:
+            node, i = self.parse_sum(tokens, i+1)
+            if i >= len(tokens) or tokens[i][0] != IPLexToken.CLOSE_BRACKET:
+                raise ValueError("Mismatched brackets in expression.")
+            return node, i+1
+        raise ValueError(f"Unexpected {text} in expression.")
 
     def parse(self, tokens):
         return self.parse_program(tokens)
     
+# the PEG grammar, as a packrat parser over positions in one token list:
+#   line       = (expr)? (NEW_LINE | EOF)
+#   expr       = assignment / add
+#   assignment = TOKEN "=" expr
+#   add        = mul (("+" / "-") mul)*
+#   mul        = term (("*" / "/") term)*
+#   term       = NUMBER / TOKEN / NEGATE term / "(" add ")"
+# rules return (node, end) or None, so failing an alternative is just a
+# return value. the (rule, position) results of expr, assignment and add are
+# memoised, which keeps parsing linear: mul and term are only reached through
+# add, and never tried twice at one position except through it.
+# trees are the same as InfixPlusParser's
+class PackratParser():
+    EXPR, ASSIGNMENT, ADD = range(3)
+    RULES = 3
+
+    # memo_size bounds the memo table (oldest entries go first), 0 turns
+    # memoisation off and None leaves it unbounded
+    def __init__(self, memo_size : Optional[int] = None):
+        self.memo_size = memo_size
+        self.memo : dict[int, Optional[tuple[IPNode, int]]] = {}
+        self.memo_hits = 0
+        self.memo_peak = 0
+
+    def parse_program(self, tokens : TokenList):
+        return (IPToken.PROGRAM, list(self.parse_lines(tokens)))
+
+    def parse(self, tokens):
+        return self.parse_program(tokens)
+
+    # lex_iter gives no positions to come back to, so collect a line at a time
+    def parse_stream(self, tokens : Iterable[tuple[IPLexToken, str]]) -> Iterator[IPNode]:
+        line = []
+        for token in tokens:
+            line.append(token)
+            if token[0] in {IPLexToken.EOF, IPLexToken.NEW_LINE}:
+                yield from self.parse_lines(line)
+                line = []
+        yield from self.parse_lines(line)
+
+    def parse_lines(self, tokens : TokenList) -> Iterator[IPNode]:
+        if isinstance(tokens, TokenArray):
+            self.kinds = tokens.kinds
+        else:
+            self.kinds = None
+        self.tokens = tokens
+        start = 0
+        length = len(tokens)
+        while start < length:
+            end = start
+            while end < length and self.kind(end) not in {IPLexToken.NEW_LINE, IPLexToken.EOF}:
+                end += 1
+            if end > start:
+                yield self.parse_line(start, end)
+            start = end + 1
+
+    def parse_line(self, start : int, end : int) -> IPNode:
+        self.end = end
+        # where the parse got furthest, for the error message
+        self.furthest = start
+        # no rule looks past the end of a line, so the memo only needs to hold one
+        self.memo.clear()
+        result = self.expr(start)
+        if result == None or result[1] != end:
+            if self.furthest >= end:
+                raise ValueError("Expression ended where a term was expected.")
+            raise ValueError(f"Unexpected {self.lexeme(self.furthest)} in expression.")
+        return result[0]
+
+    def kind(self, i : int) -> int:
+        if self.kinds != None:
+            return self.kinds[i]
+        return self.tokens[i][0]
+
+    def lexeme(self, i : int) -> str:
+        if self.kinds != None:
+            return self.tokens.lexeme(i)
+        return self.tokens[i][1]
+
+    def peek(self, i : int) -> Optional[int]:
+        if i < self.end:
+            return self.kind(i)
+        if i > self.furthest:
+            self.furthest = i
+        return None
+
+    def memoised(self, rule : int, fn, i : int) -> Optional[tuple[IPNode, int]]:
+        if self.memo_size == 0:
+            return fn(i)
+        key = i * self.RULES + rule
+        if key in self.memo:
+            self.memo_hits += 1
+            return self.memo[key]
+        result = fn(i)
+        if self.memo_size != None and len(self.memo) >= self.memo_size:
+            del self.memo[next(iter(self.memo))]
+        self.memo[key] = result
+        self.memo_peak = max(self.memo_peak, len(self.memo))
+        return result
+
+    def expr(self, i : int) -> Optional[tuple[IPNode, int]]:
+        return self.memoised(self.EXPR, self.expr_rule, i)
+
+    def expr_rule(self, i : int) -> Optional[tuple[IPNode, int]]:
+        result = self.memoised(self.ASSIGNMENT, self.assignment_rule, i)
+        if result == None or (result[1] != self.end):
+            # an assignment has to run to the end of the line, as in InfixPlusParser
+            result = self.memoised(self.ADD, self.add_rule, i)
+        if result == None:
+            return None
+        return (IPToken.EXPR, result[0]), result[1]
+
+    def assignment_rule(self, i : int) -> Optional[tuple[IPNode, int]]:
+        if self.peek(i) != IPLexToken.TOKEN or self.peek(i+1) != IPLexToken.ASSIGN:
+            return None
+        value = self.expr(i+2)
+        if value == None:
+            return None
+        target = (IPToken.TOKEN, self.lexeme(i))
+        return (IPToken.ASSIGNMENT, [target, value[0]]), value[1]
+
+    def add_rule(self, i : int) -> Optional[tuple[IPNode, int]]:
+        result = self.mul_rule(i)
+        if result == None:
+            return None
+        left, i = result
+        while self.peek(i) in {IPLexToken.PLUS, IPLexToken.MINUS}:
+            right = self.mul_rule(i+1)
+            if right == None:
+                break
+            left = (binary_ops[self.kind(i)], [left, right[0]])
+            i = right[1]
+        return left, i
+
+    def mul_rule(self, i : int) -> Optional[tuple[IPNode, int]]:
+        result = self.term_rule(i)
+        if result == None:
+            return None
+        left, i = result
+        while self.peek(i) in {IPLexToken.MULTIPLY, IPLexToken.DIVIDE}:
+            right = self.term_rule(i+1)
+            if right == None:
+                break
+            left = (binary_ops[self.kind(i)], [left, right[0]])
+            i = right[1]
+        return left, i
+
+    def term_rule(self, i : int) -> Optional[tuple[IPNode, int]]:
+        kind = self.peek(i)
+        if kind == IPLexToken.NUMBER:
+            return (IPToken.NUMBER, self.lexeme(i)), i+1
+        elif kind == IPLexToken.TOKEN:
+            return (IPToken.TOKEN, self.lexeme(i)), i+1
+        elif kind == IPLexToken.NEGATE:
+            result = self.term_rule(i+1)
+            if result == None:
+                return None
+            return (IPToken.NEGATE, [result[0]]), result[1]
+        elif kind == IPLexToken.OPEN_BRACKET:
+            result = self.memoised(self.ADD, self.add_rule, i+1)
+            if result == None or self.peek(result[1]) != IPLexToken.CLOSE_BRACKET:
+                return None
+            return result[0], result[1]+1
+        if kind != None and i > self.furthest:
+            self.furthest = i
+        return None
+
+# shunting-yard as a pushdown table for AbstractParser. operands go on
+# obj.output and pending operators on obj.stack, as IPTokens. an open bracket
+# is kept on the stack as EXPR, and each "=" at the start of a line as
+# ASSIGNMENT with its target on obj.output. trees are the same as
+# InfixPlusParser's
+precedence = {
+    IPToken.EXPR: -1,
+    IPToken.ASSIGNMENT: 0,
+    IPToken.ADD: 1,
+    IPToken.SUBTRACT: 1,
+    IPToken.MULTIPLY: 2,
+    IPToken.DIVIDE: 2,
+    IPToken.NEGATE: 3
+}
+
+def reduce_top(obj : AbstractParser):
+    op = obj.stack.pop()
+    output = obj.output
+    if op == IPToken.NEGATE:
+        output[-1] = (IPToken.NEGATE, [output[-1]])
+    elif op == IPToken.ASSIGNMENT:
+        value = output.pop()
+        output[-1] = (IPToken.ASSIGNMENT, [output[-1], (IPToken.EXPR, value)])
+    else:
+        right = output.pop()
+        output[-1] = (op, [output[-1], right])
+
+def push_number(obj : AbstractParser, token : tuple[IPLexToken, str]):
+    obj.output.append((IPToken.NUMBER, token[1]))
+
+def push_token(obj : AbstractParser, token : tuple[IPLexToken, str]):
+    obj.output.append((IPToken.TOKEN, token[1]))
+
+def push_negate(obj : AbstractParser, token : tuple[IPLexToken, str]):
+    obj.stack.append(IPToken.NEGATE)
+
+def push_bracket(obj : AbstractParser, token : tuple[IPLexToken, str]):
+    obj.stack.append(IPToken.EXPR)
+
+def push_assign(obj : AbstractParser, token : tuple[IPLexToken, str]):
+    obj.stack.append(IPToken.ASSIGNMENT)
+
+def push_binary(obj : AbstractParser, token : tuple[IPLexToken, str]):
+    # everything on the stack binding at least as tightly goes first, which
+    # makes the operators left associative
+    op = binary_ops[token[0]]
+    level = precedence[op]
+    stack = obj.stack
+    while len(stack) > 0 and precedence[stack[-1]] >= level:
+        reduce_top(obj)
+    stack.append(op)
+
+def close_bracket(obj : AbstractParser, token : tuple[IPLexToken, str]):
+    stack = obj.stack
+    # assignments can't be inside brackets, so stop at those too
+    while len(stack) > 0 and precedence[stack[-1]] > 0:
+        reduce_top(obj)
+    if len(stack) == 0 or stack[-1] != IPToken.EXPR:
+        raise ValueError("Mismatched brackets in expression.")
+    stack.pop()
+
+def end_line(obj : AbstractParser, token : Optional[tuple[IPLexToken, str]]):
+    stack = obj.stack
+    while len(stack) > 0:
+        if stack[-1] == IPToken.EXPR:
+            raise ValueError("Mismatched brackets in expression.")
+        reduce_top(obj)
+    obj.results.append((IPToken.EXPR, obj.output.pop()))
+
+line_ends = (IPLexToken.NEW_LINE, IPLexToken.EOF, None)
+binary_kinds = tuple(binary_ops)
+
+pushdown_transitions = {
+    # blank and comment-only lines have no tokens, so just end here
+    'line-start': [
+        (line_ends, 'line-start', ()),
+        ((IPLexToken.TOKEN,), 'target', push_token),
+        ((IPLexToken.NUMBER,), 'expect-operator', push_number),
+        ((IPLexToken.NEGATE,), 'expect-expr', push_negate),
+        ((IPLexToken.OPEN_BRACKET,), 'expect-expr', push_bracket)
+    ],
+    # after "=", which can start another assignment but not end the line
+    'assign-value': [
+        ((IPLexToken.TOKEN,), 'target', push_token),
+        ((IPLexToken.NUMBER,), 'expect-operator', push_number),
+        ((IPLexToken.NEGATE,), 'expect-expr', push_negate),
+        ((IPLexToken.OPEN_BRACKET,), 'expect-expr', push_bracket)
+    ],
+    # a name which could be assigned to
+    'target': [
+        (line_ends, 'line-start', end_line),
+        ((IPLexToken.ASSIGN,), 'assign-value', push_assign),
+        (binary_kinds, 'expect-expr', push_binary)
+    ],
+    'expect-expr': [
+        ((IPLexToken.TOKEN,), 'expect-operator', push_token),
+        ((IPLexToken.NUMBER,), 'expect-operator', push_number),
+        ((IPLexToken.NEGATE,), 'expect-expr', push_negate),
+        ((IPLexToken.OPEN_BRACKET,), 'expect-expr', push_bracket)
+    ],
+    'expect-operator': [
+        (line_ends, 'line-start', end_line),
+        (binary_kinds, 'expect-expr', push_binary),
+        ((IPLexToken.CLOSE_BRACKET,), 'expect-operator', close_bracket)
+    ]
+}
+
+class PushdownParser(AbstractParser):
+    def __init__(self):
+        super().__init__(pushdown_transitions, 'line-start')
+
+    def parse_stream(self, tokens : Iterable[tuple[IPLexToken, str]]) -> Iterator[IPNode]:
+        return self.parse_iter(tokens)
+
+    def parse_program(self, tokens : TokenList):
+        return (IPToken.PROGRAM, self.parse(tokens))
+
 if __name__ == "__main__":
-    luthor = InfixPlusLexer()
     kal_el = InfixPlusParser()
 
     arg_parser = ArgumentParser(prog="Infix Plus Lexer")
     arg_parser.add_argument('-i', '--input',action='store')
+    arg_parser.add_argument('-s', '--stream',action='store_true')
+    arg_parser.add_argument('-g', '--generated',action='store_true')
+    arg_parser.add_argument('-c', '--compact',action='store_true')
+    arg_parser.add_argument('-k', '--packrat',action='store_true')
+    arg_parser.add_argument('-m', '--memo-size',type=int,help="bound the packrat memo table, 0 turns it off")
+    arg_parser.add_argument('-d', '--pushdown',action='store_true')
+    arg_parser.add_argument('-C', '--cache',action='store_true',help="keep the parsed program in __ipcache__ and reuse it while the file is unchanged")
 
     args = arg_parser.parse_args(sys.argv[1:])
+    # the cache always lexes and parses with the defaults, and its entries
+    # are keyed on them, so it can't honour the other choices
+    if args.cache:
+        ignored = [flag for flag, chosen in (("-s", args.stream), ("-g", args.generated), ("-c", args.compact), ("-k", args.packrat), ("-d", args.pushdown), ("-m", args.memo_size != None)) if chosen]
+        if len(ignored) > 0:
+            arg_parser.error(f"-C/--cache can't be used with {', '.join(ignored)}")
+
+    if args.packrat:
+        kal_el = PackratParser(args.memo_size)
+    elif args.pushdown:
+        kal_el = PushdownParser()
 
-    if args.input:
+    if args.generated:
+        luthor = GeneratedInfixPlusLexer()
+    else:
+        luthor = InfixPlusLexer()
+
+    if args.input and args.stream:
+        with open(args.input,'r') as f:
+            for expr_node in kal_el.parse_stream(luthor.lex_iter(f)):
+                print(expr_node)
+    elif args.input and args.cache:
+        # imported here since ipcache imports this module
+        from ipcache import ProgramCache
+        with open(args.input,'r') as f:
+            print(ProgramCache().load(f.read()).ast)
+    elif args.input:
         with open(args.input,'r') as f:
             file = f.read()
-        tokens = luthor.lex(file)
-        ast = kal_el.parse(tokens)
\ No newline at end of file
+        if args.compact:
+            tokens = luthor.lex_compact(file, IPLexToken)
+        else:
+            tokens = luthor.lex(file)
+        ast = kal_el.parse(tokens)
+        if args.packrat or args.pushdown:
+            print(ast[1] if args.packrat else ast)
\ No newline at end of file
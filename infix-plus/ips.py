@@ -0,0 +1,188 @@
+# IPS = Infix Plus Scheduler
+# runs the statements of a program in wavefronts: every statement in a
+# wavefront only depends on statements in earlier ones, so a wavefront can run
+# on a thread pool. numpy releases the GIL in whole-array operations, so
+# statements over large arrays really do run at once. results are the same as
+# running the program in order with ipe.run_program
+# python ips.py -i program.ip -c x=x.npy -c y=y.npy -w 4
+
+from argparse import ArgumentParser
+from concurrent.futures import ThreadPoolExecutor
+from time import perf_counter
+from typing import Optional
+import sys
+
+from ipl import InfixPlusLexer
+from ipp import InfixPlusParser, IPToken, IPNode
+from ipe import evaluate_expr, output_names, column_length, parse_column, require_numpy
+from ipc import parse_binding
+from ipd import references
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+def targets(node : IPNode) -> set[str]:
+    names = set()
+    stack = [node]
+    while len(stack) > 0:
+        kind, children = stack.pop()
+        if kind == IPToken.ASSIGNMENT:
+            names.add(children[0][1])
+            stack.append(children[1])
+        elif kind == IPToken.EXPR:
+            stack.append(children)
+        elif kind not in {IPToken.NUMBER, IPToken.TOKEN}:
+            stack.extend(children)
+    return names
+
+# statement index -> the earlier statements it has to wait for. a statement
+# waits for the last write of each name it reads, and a write waits for the
+# last write of that name and every read of it since, so nothing sees a value
+# from the wrong point in the program
+def statement_dag(ast : list[IPNode]) -> list[set[int]]:
+    last_write : dict[str, int] = {}
+    reads_since : dict[str, list[int]] = {}
+    dag = []
+    for i, node in enumerate(ast):
+        reads = references(node)
+        writes = targets(node)
+        deps = set()
+        for name in reads:
+            if name in last_write:
+                deps.add(last_write[name])
+        for name in writes:
+            if name in last_write:
+                deps.add(last_write[name])
+            deps.update(reads_since.pop(name, ()))
+        for name in reads:
+            reads_since.setdefault(name, []).append(i)
+        for name in writes:
+            last_write[name] = i
+        # a = a + 1 reads a before writing it
+        deps.discard(i)
+        dag.append(deps)
+    return dag
+
+# groups statements by how long a chain of dependencies leads up to them.
+# each wavefront keeps program order
+def wavefronts(dag : list[set[int]]) -> list[list[int]]:
+    level = []
+    waves : list[list[int]] = []
+    for i, deps in enumerate(dag):
+        wave = max((level[dep] + 1 for dep in deps), default=0)
+        level.append(wave)
+        if wave == len(waves):
+            waves.append([])
+        waves[wave].append(i)
+    return waves
+
+def run_statement(node : IPNode, env : dict) -> tuple[bool, object]:
+    try:
+        return True, evaluate_expr(node, env)
+    except (ValueError, ArithmeticError) as e:
+        return False, e
+
+# returns the results, named as ipe.run_program names them, and
+# (statements, seconds) for each wavefront
+def run_wavefronts(ast : list[IPNode], env : Optional[dict] = None, workers : int = 4, pool : Optional[ThreadPoolExecutor] = None) -> tuple[dict, list[tuple[int, float]]]:
+    env = {} if env == None else env
+    waves = wavefronts(statement_dag(ast))
+    values = [None] * len(ast)
+    done = [False] * len(ast)
+    timings = []
+
+    own_pool = pool == None and workers > 1
+    if own_pool:
+        pool = ThreadPoolExecutor(workers)
+    try:
+        for wave in waves:
+            start = perf_counter()
+            if len(wave) == 1 or pool == None:
+                outcomes = [run_statement(ast[i], env) for i in wave]
+            else:
+                # no two statements in a wavefront write the same name, or
+                # read a name another one writes, so they can share env
+                outcomes = list(pool.map(lambda i : run_statement(ast[i], env), wave))
+            timings.append((len(wave), perf_counter() - start))
+
+            failed = None
+            for i, (ok, value) in zip(wave, outcomes):
+                if ok:
+                    values[i] = value
+                    done[i] = True
+                elif failed == None:
+                    failed = (i, value)
+            if failed != None:
+                # run in order the earlier statements that haven't run yet, so
+                # the error raised is the one running in order would raise
+                first, error = failed
+                for i in range(first):
+                    if not done[i]:
+                        evaluate_expr(ast[i], env)
+                raise error
+    finally:
+        if own_pool:
+            pool.shutdown()
+
+    results = {}
+    for name, value in zip(output_names(ast), values):
+        results[name] = value
+    return results, timings
+
+def same_results(a : dict, b : dict) -> bool:
+    if a.keys() != b.keys():
+        return False
+    if np != None:
+        return all(np.array_equal(a[name], b[name], equal_nan=True) for name in a)
+    return all(a[name] == b[name] or (a[name] != a[name] and b[name] != b[name]) for name in a)
+
+if __name__ == "__main__":
+    arg_parser = ArgumentParser(prog="Infix Plus Scheduler")
+    arg_parser.add_argument('-i', '--input', required=True)
+    arg_parser.add_argument('-c', '--column', action='append', default=[], help="bind an identifier to a .npy file, as name=path.npy")
+    arg_parser.add_argument('-b', '--bind', action='append', default=[], help="give an identifier a value, as name=value")
+    arg_parser.add_argument('-w', '--workers', type=int, default=4, help="threads to run a wavefront on, 1 runs in this one")
+    arg_parser.add_argument('-t', '--timings', action='store_true', help="print how long each wavefront took")
+    arg_parser.add_argument('-s', '--sequential', action='store_true', help="also run the program in order, and check and time it")
+
+    args = arg_parser.parse_args(sys.argv[1:])
+
+    with open(args.input) as f:
+        text = f.read()
+
+    lexer = InfixPlusLexer()
+    parser = InfixPlusParser()
+    ast = list(parser.parse_stream(lexer.lex(text)))
+
+    env = dict(map(parse_binding, args.bind))
+    if len(args.column) > 0:
+        require_numpy()
+        for name, path in map(parse_column, args.column):
+            env[name] = np.load(path)
+        column_length(env)
+
+    start = perf_counter()
+    results, timings = run_wavefronts(ast, dict(env), args.workers)
+    total = perf_counter() - start
+
+    if args.timings:
+        for i, (count, seconds) in enumerate(timings):
+            print(f"Wavefront {i}: {count} statements in {seconds:.4f}s")
+    print(f"Ran {len(ast)} statements in {len(timings)} wavefronts in {total:.4f}s")
+
+    if args.sequential:
+        start = perf_counter()
+        expected = {}
+        sequential_env = dict(env)
+        for name, node in zip(output_names(ast), ast):
+            expected[name] = evaluate_expr(node, sequential_env)
+        print(f"Ran in order in {perf_counter() - start:.4f}s")
+        if not same_results(results, expected):
+            print("Results differ from running in order.", file=sys.stderr)
+            sys.exit(1)
+
+    if len(args.column) == 0:
+        for name, value in results.items():
+            print(f"{name} = {value}")
@@ -0,0 +1,113 @@
+# checks the VM against the tree walkers it replaces and times them on long
+# programs. run from the infix-vm directory: python bench_vm.py
+
+from argparse import ArgumentParser
+from random import Random
+from time import perf_counter
+import sys
+
+sys.path.insert(1,"../abstract-lexer")
+sys.path.insert(1,"../infix-parser")
+sys.path.insert(1,"../infix-plus")
+
+from vm import VM, dumps, loads
+from infix import InfixCursorLexer, InfixClimbingParser, evaluate
+from bytecode import compile_bytecode, evaluate_bytecode
+from bench_infix import make_expression, make_sized_expression, outcome, best_time
+from bench_lexer import make_ipl_source
+from ipl import InfixPlusLexer
+from ipp import InfixPlusParser
+import ipe
+import ipc
+
+def same(a, b) -> bool:
+    # nan != nan
+    return a == b or (a != a and b != b)
+
+def check_calculator(count : int, seed : int = 0):
+    rng = Random(seed)
+    lexer = InfixCursorLexer()
+    parser = InfixClimbingParser()
+    # empty input has no tree, and evaluates to None
+    expressions = ["", "  "] + [make_expression(rng, rng.randint(1, 12), max_depth=rng.randint(0, 4), operators=rng.choice(["+-*/", "+-*/^"])) for _ in range(count)]
+    for expression in expressions:
+        root = parser.parse(lexer.lex(expression))
+        expected = outcome(lambda : evaluate(root))
+        # round trip through the cache format too
+        bytecode = loads(dumps(compile_bytecode(root)))
+        value = outcome(lambda : evaluate_bytecode(bytecode))
+        if not same(value, expected):
+            raise AssertionError(f"VM disagrees with evaluate on {expression}")
+    print(f"VM agrees with evaluate on {count} random expressions")
+
+def compare_calculator(sizes : list[int], repeats : int):
+    lexer = InfixCursorLexer()
+    parser = InfixClimbingParser()
+    print(f"{'chars':>10}{'instrs':>10}{'compile s':>12}{'tree s':>12}{'vm s':>12}{'speedup':>10}")
+    for size in sizes:
+        root = parser.parse(lexer.lex(make_sized_expression(size)))
+        compile_time, bytecode = best_time(lambda : compile_bytecode(root), 1)
+        vm = VM(bytecode)
+        tree_time, expected = best_time(lambda : evaluate(root), repeats)
+        vm_time, values = best_time(vm.run, repeats)
+        if not same(values[0], expected):
+            raise AssertionError(f"VM disagrees with evaluate at {size} characters")
+        print(f"{size:>10}{len(bytecode):>10}{compile_time:>12.4f}{tree_time:>12.4f}{vm_time:>12.4f}{tree_time / vm_time:>9.1f}x")
+
+def program_outcome(fn):
+    try:
+        return fn()
+    except ArithmeticError as e:
+        return type(e)
+
+def bind_inputs(rng : Random, names : list[str]) -> dict[str, float]:
+    return {name : float(rng.randint(1, 100)) for name in names}
+
+def check_programs(count : int, seed : int = 0):
+    rng = Random(seed)
+    lexer = InfixPlusLexer()
+    parser = InfixPlusParser()
+    for i in range(count):
+        ast = list(parser.parse_stream(lexer.lex(make_ipl_source(rng.randint(20, 400), seed=i))))
+        bytecode = loads(dumps(ipc.compile_program(ast)))
+        inputs = bind_inputs(rng, bytecode.inputs)
+        expected = program_outcome(lambda : ipe.run_program(ast, dict(inputs)))
+        values = program_outcome(lambda : ipc.run_program(bytecode, inputs))
+        if isinstance(expected, dict) and isinstance(values, dict):
+            if expected.keys() != values.keys() or not all(same(values[k], expected[k]) for k in expected):
+                raise AssertionError(f"VM disagrees with ipe on program {i}")
+        elif expected != values:
+            raise AssertionError(f"VM and ipe fail differently on program {i}")
+    print(f"VM agrees with ipe on {count} random programs")
+
+def compare_programs(sizes : list[int], repeats : int):
+    lexer = InfixPlusLexer()
+    parser = InfixPlusParser()
+    rng = Random(0)
+    print(f"{'chars':>10}{'instrs':>10}{'compile s':>12}{'ipe s':>12}{'vm s':>12}{'speedup':>10}")
+    for size in sizes:
+        ast = list(parser.parse_stream(lexer.lex(make_ipl_source(size))))
+        compile_time, bytecode = best_time(lambda : ipc.compile_program(ast), 1)
+        inputs = bind_inputs(rng, bytecode.inputs)
+        vm = VM(bytecode)
+        tree_time, expected = best_time(lambda : program_outcome(lambda : ipe.run_program(ast, dict(inputs))), repeats)
+        vm_time, values = best_time(lambda : program_outcome(lambda : vm.run(inputs)), repeats)
+        if isinstance(expected, dict) != isinstance(values, list):
+            raise AssertionError(f"VM and ipe fail differently at {size} characters")
+        print(f"{size:>10}{len(bytecode):>10}{compile_time:>12.4f}{tree_time:>12.4f}{vm_time:>12.4f}{tree_time / vm_time:>9.1f}x")
+
+if __name__ == "__main__":
+    arg_parser = ArgumentParser(prog="VM Benchmark")
+    arg_parser.add_argument('-s', '--sizes', nargs='+', type=int, default=[1000, 10000, 100000])
+    arg_parser.add_argument('-r', '--repeats', type=int, default=3)
+    arg_parser.add_argument('-c', '--check', type=int, default=1000, help="random inputs for the differential checks")
+
+    args = arg_parser.parse_args(sys.argv[1:])
+
+    # evaluate recurses once per operator on long expressions
+    sys.setrecursionlimit(1000000)
+
+    check_calculator(args.check)
+    compare_calculator(args.sizes, args.repeats)
+    check_programs(args.check)
+    compare_programs(args.sizes, args.repeats)
@@ -0,0 +1,209 @@
+# a register VM shared by the infix calculator and infix-plus.
+# every value lives in one flat list of float registers: variable slots come
+# first, then constants (filled in once, when the program is loaded), then
+# temporaries. names are only looked at when inputs are bound, never while
+# running. instructions are (op, dst, a, b) with a and b register numbers
+
+from array import array
+from enum import IntEnum
+from hashlib import sha256
+from typing import Callable, Optional
+import marshal
+import os
+
+# bump whenever the instruction set or the marshalled layout changes
+VM_VERSION = 1
+
+class Op(IntEnum):
+    MOVE = 0
+    NEGATE = 1
+    ADD = 2
+    SUBTRACT = 3
+    MULTIPLY = 4
+    DIVIDE = 5
+    POWER = 6
+    # appends register a to the program's outputs
+    OUT = 7
+
+class Bytecode():
+    def __init__(self):
+        self.code = array('I')
+        self.consts : list[float] = []
+        # name -> register, for variables. inputs are the ones read before
+        # they're assigned, which have to be bound when the program runs
+        self.slots : dict[str, int] = {}
+        self.inputs : list[str] = []
+        # what each OUT is called, if the front end names them
+        self.output_names : list[str] = []
+        self.register_count = 0
+        self.const_base = 0
+
+    def emit(self, op : Op, dst : int, a : int = 0, b : int = 0):
+        self.code.extend((op, dst, a, b))
+
+    def instructions(self) -> list[tuple[int, int, int, int]]:
+        code = self.code
+        return [tuple(code[i:i+4]) for i in range(0, len(code), 4)]
+
+    def registers(self) -> list[float]:
+        # the register file a run starts from, with the constants in place
+        registers = [0.0] * self.register_count
+        registers[self.const_base:self.const_base + len(self.consts)] = self.consts
+        return registers
+
+    def __len__(self) -> int:
+        return len(self.code) // 4
+
+    def __repr__(self) -> str:
+        lines = [f"Bytecode({self.register_count} registers, slots {self.slots}, consts {self.consts})"]
+        for op, dst, a, b in self.instructions():
+            lines.append(f"  {Op(op).name:<10}{dst:>5}{a:>5}{b:>5}")
+        return "\n".join(lines)
+
+def dumps(bytecode : Bytecode) -> bytes:
+    return marshal.dumps((
+        VM_VERSION,
+        bytecode.code.tobytes(),
+        bytecode.consts,
+        bytecode.slots,
+        bytecode.inputs,
+        bytecode.output_names,
+        bytecode.register_count,
+        bytecode.const_base
+    ))
+
+def loads(data : bytes) -> Bytecode:
+    fields = marshal.loads(data)
+    if fields[0] != VM_VERSION:
+        raise ValueError(f"Bytecode is from VM version {fields[0]}, not {VM_VERSION}")
+    bytecode = Bytecode()
+    bytecode.code.frombytes(fields[1])
+    bytecode.consts = fields[2]
+    bytecode.slots = fields[3]
+    bytecode.inputs = fields[4]
+    bytecode.output_names = fields[5]
+    bytecode.register_count = fields[6]
+    bytecode.const_base = fields[7]
+    return bytecode
+
+# front ends emit through a builder, which numbers variables, constants and
+# temporaries separately and lays them out in one register file at the end.
+# a register reference is (space, index)
+VAR, CONST, TEMP = range(3)
+Register = tuple[int, int]
+
+class BytecodeBuilder():
+    def __init__(self):
+        self.slots : dict[str, int] = {}
+        self.inputs : list[str] = []
+        self.const_ids : dict[str, int] = {}
+        self.consts : list[float] = []
+        self.temp_count = 0
+        self.output_names : list[str] = []
+        self.pending : list[tuple[Op, Register, Register, Register]] = []
+
+    def var(self, name : str, reading : bool = True) -> Register:
+        if name not in self.slots:
+            self.slots[name] = len(self.slots)
+            # read before anything assigned it, so it has to come from outside
+            if reading:
+                self.inputs.append(name)
+        return (VAR, self.slots[name])
+
+    def const(self, value : float) -> Register:
+        # keyed by repr so 0.0 and -0.0 stay apart
+        key = repr(value)
+        if key not in self.const_ids:
+            self.const_ids[key] = len(self.consts)
+            self.consts.append(value)
+        return (CONST, self.const_ids[key])
+
+    def temp(self, depth : int) -> Register:
+        # temporaries are numbered by expression depth, so siblings reuse them
+        self.temp_count = max(self.temp_count, depth + 1)
+        return (TEMP, depth)
+
+    def emit(self, op : Op, dst : Register, a : Register = (TEMP, 0), b : Register = (TEMP, 0)):
+        self.pending.append((op, dst, a, b))
+
+    def output(self, value : Register, name : str = None):
+        self.emit(Op.OUT, (TEMP, 0), value)
+        self.output_names.append(name)
+
+    def finish(self) -> Bytecode:
+        bytecode = Bytecode()
+        bases = (0, len(self.slots), len(self.slots) + len(self.consts))
+        for op, dst, a, b in self.pending:
+            bytecode.emit(op, bases[dst[0]] + dst[1], bases[a[0]] + a[1], bases[b[0]] + b[1])
+        bytecode.consts = self.consts
+        bytecode.slots = dict(self.slots)
+        bytecode.inputs = list(self.inputs)
+        bytecode.output_names = list(self.output_names)
+        bytecode.const_base = bases[CONST]
+        # at least one temporary, which OUT names as its unused destination
+        bytecode.register_count = bases[TEMP] + max(1, self.temp_count)
+        return bytecode
+
+def load_cached(cache_dir : str, key : str, build : Callable[[], Bytecode]) -> Bytecode:
+    # bytecode for key (e.g. the front end's name and version plus the
+    # source), from cache_dir if it was built before
+    digest = sha256(f"{VM_VERSION}\0{key}".encode("utf-8")).hexdigest()[:32]
+    path = os.path.join(cache_dir, f"{digest}.ivm")
+    try:
+        with open(path, "rb") as f:
+            return loads(f.read())
+    except (OSError, ValueError, EOFError, TypeError):
+        pass
+
+    bytecode = build()
+    os.makedirs(cache_dir, exist_ok=True)
+    # write then rename so a concurrent run never reads half a file
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    with open(temp_path, "wb") as f:
+        f.write(dumps(bytecode))
+    os.replace(temp_path, path)
+    return bytecode
+
+class VM():
+    def __init__(self, bytecode : Bytecode):
+        self.bytecode = bytecode
+        # decoded once, so run only unpacks tuples
+        self.program = bytecode.instructions()
+        self.initial = bytecode.registers()
+
+    def bind(self, inputs : Optional[dict[str, float]] = None) -> list[float]:
+        registers = self.initial[:]
+        inputs = {} if inputs == None else inputs
+        for name in self.bytecode.inputs:
+            if name not in inputs:
+                raise ValueError(f"{name} is not bound to a value.")
+            registers[self.bytecode.slots[name]] = inputs[name]
+        return registers
+
+    def run(self, inputs : Optional[dict[str, float]] = None) -> list[float]:
+        return self.execute(self.bind(inputs))
+
+    def execute(self, r : list[float]) -> list[float]:
+        # the ops are compared as ints in rough order of how common they are
+        out = []
+        for op, dst, a, b in self.program:
+            if op == 2:
+                r[dst] = r[a] + r[b]
+            elif op == 4:
+                r[dst] = r[a] * r[b]
+            elif op == 3:
+                r[dst] = r[a] - r[b]
+            elif op == 5:
+                r[dst] = r[a] / r[b]
+            elif op == 1:
+                r[dst] = -r[a]
+            elif op == 0:
+                r[dst] = r[a]
+            elif op == 6:
+                r[dst] = r[a] ** r[b]
+            else:
+                out.append(r[a])
+        return out
+
+def run(bytecode : Bytecode, inputs : Optional[dict[str, float]] = None) -> list[float]:
+    return VM(bytecode).run(inputs)